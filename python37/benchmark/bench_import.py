@@ -0,0 +1,103 @@
+# -*-coding:utf-8-*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Import time of the messaging module, measured with python -X importtime in fresh
+interpreters. Exits 1 when the median is above --max-ms or when importing messaging
+pulls in a module that should only be loaded on use, e.g. requests.
+
+Run from the python37 directory:
+    python -m benchmark.bench_import [--runs 7] [--max-ms 50]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULE = 'src.push_admin.messaging'
+
+# imported on the first network call or the first use of an optional feature
+DEFERRED = ('requests', 'urllib3', 'asyncio', 'multiprocessing', 'concurrent.futures')
+
+
+def measure(module=MODULE):
+    """
+    :return: (cumulative import time of module in ms, dict of module -> self time in ms)
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total, self_times = None, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name == 'site':
+            # the modules imported before are those of the interpreter start up
+            self_times.clear()
+            continue
+        self_times[name] = int(self_us) / 1000.0
+        if name == module:
+            total = int(cumulative_us) / 1000.0
+    return total, self_times
+
+
+def loaded_deferred(module=MODULE):
+    """:return: the DEFERRED modules loaded by importing module"""
+    code = 'import sys, {0}; print(" ".join(m for m in {1!r} if m in sys.modules))'.format(module, DEFERRED)
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time regression check of the messaging module.')
+    parser.add_argument('--runs', type=int, default=7, help='fresh interpreters to measure')
+    parser.add_argument('--max-ms', type=float, default=50.0, help='median import time threshold')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    args = parser.parse_args()
+
+    # a first run compiles the byte code, it is not counted
+    measure()
+    totals, self_times = [], {}
+    for _ in range(args.runs):
+        total, times = measure()
+        totals.append(total)
+        for name, ms in times.items():
+            self_times.setdefault(name, []).append(ms)
+    median = statistics.median(totals)
+    print('import {0}: median {1:.1f} ms, min {2:.1f} ms, max {3:.1f} ms over {4} runs'.format(
+        MODULE, median, min(totals), max(totals), args.runs))
+    print('slowest modules by self time:')
+    slowest = sorted(((statistics.median(times), name) for name, times in self_times.items()), reverse=True)
+    for ms, name in slowest[:args.top]:
+        print('  {0:8.2f} ms  {1}'.format(ms, name))
+
+    failed = False
+    deferred = loaded_deferred()
+    if deferred:
+        print('imported eagerly but should be deferred: {0}'.format(', '.join(deferred)))
+        failed = True
+    if median > args.max_ms:
+        print('median import time {0:.1f} ms is above the threshold of {1:.1f} ms'.format(median, args.max_ms))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# -*-coding:utf-8-*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Push path benchmark suite: validation, serialization, template rendering, end to end
+send throughput and topic operations against the local HCM stub.
+
+Run from the python37 directory:
+    python -m benchmark.bench_push                          # run all cases
+    python -m benchmark.bench_push --save baseline.json     # keep the results
+    python -m benchmark.bench_push --compare baseline.json  # fail on regressions
+
+The stub runs inside the benchmark process by default and competes with the sender
+threads for the GIL. For network cases start it separately and pass --stub-url:
+    python -m benchmark.stub_server --port 8080 &
+    python -m benchmark.bench_push --stub-url http://127.0.0.1:8080
+"""
+
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from src import push_admin
+from src.push_admin import messaging
+from src.push_admin import _app
+from src.push_admin import _message_serializer
+from benchmark.bench_template import build_message, make_batch
+from benchmark.stub_server import StubConfig, StubServer
+
+BENCH_APP_ID = 'bench-app'
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, failures=0):
+    latencies.sort()
+    return {
+        'count': len(latencies),
+        'failures': failures,
+        'ops_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def run_serial(operation, count):
+    latencies = []
+    start = time.perf_counter()
+    for index in range(count):
+        begin = time.perf_counter()
+        operation(index)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_concurrent(operation, count, threads):
+    """
+    operation(index) raises ApiCallError or returns False for a failed request, e.g. an error
+    injected by the stub; failures are counted and their latency left out
+    """
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    counter = iter(range(count))
+
+    def worker():
+        local = []
+        failed = 0
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            begin = time.perf_counter()
+            try:
+                ok = operation(index) is not False
+            except messaging.ApiCallError:
+                ok = False
+            if not ok:
+                failed += 1
+                continue
+            local.append(time.perf_counter() - begin)
+        with lock:
+            latencies.extend(local)
+            failures[0] += failed
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, failures[0])
+
+
+def bench_validate(count):
+    return run_serial(lambda i: build_message('user', 'body', 'token-{0}'.format(i)), count)
+
+
+def bench_serialize(count):
+    encoder = _message_serializer.MessageSerializer()
+    message = build_message('user', 'body', 'token')
+    return run_serial(lambda i: json.dumps({'validate_only': False, 'message': encoder.default(message)}), count)
+
+
+def bench_template_render(count):
+    template = messaging.MessageTemplate(build_message('${name}', '${body}', '${token}'))
+    batch = make_batch(count)
+    rows = list(zip(batch['name'], batch['body'], batch['token']))
+    return run_serial(lambda i: template.render(name=rows[i][0], body=rows[i][1], token=rows[i][2]), count)
+
+
+def bench_send(count, threads):
+    message = build_message('user', 'body', 'token')
+    success = _app.App.SUCCESS_CODE
+    return run_concurrent(lambda i: messaging.send_message(message, app_id=BENCH_APP_ID).code == success,
+                          count, threads)
+
+
+def bench_topics(count, threads):
+    def operation(index):
+        token = 'token-{0}'.format(index)
+        kind = index % 3
+        if kind == 0:
+            messaging.subscribe_topic('bench', [token], app_id=BENCH_APP_ID)
+        elif kind == 1:
+            messaging.unsubscribe_topic('bench', [token], app_id=BENCH_APP_ID)
+        else:
+            messaging.list_topics(token, app_id=BENCH_APP_ID, use_cache=False)
+    return run_concurrent(operation, count, threads)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """print the change against a baseline, return the names of regressed cases"""
+    regressions = []
+    print('\n{0:<12} {1:>14} {2:>14} {3:>9}'.format('case', 'baseline/s', 'current/s', 'change'))
+    for name, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if previous is None or not previous['ops_per_sec']:
+            continue
+        change = current['ops_per_sec'] / previous['ops_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{0:<12} {1:>14,.0f} {2:>14,.0f} {3:>+8.1%}{4}'.format(
+            name, previous['ops_per_sec'], current['ops_per_sec'], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Push path benchmark suite.')
+    parser.add_argument('--cases', default='validate,serialize,template,send,topics',
+                        help='comma separated cases to run')
+    parser.add_argument('--count', type=int, default=20000, help='iterations of the CPU bound cases')
+    parser.add_argument('--requests', type=int, default=2000, help='requests of the network cases')
+    parser.add_argument('--threads', type=int, default=8, help='sender threads of the network cases')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='stub error rate')
+    parser.add_argument('--stub-url', help='use an already running stub server instead of an in-process one')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='throughput drop reported as regression, default 0.10')
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    results = {'revision': git_revision(), 'python': platform.python_version(), 'cases': {}}
+
+    if args.stub_url:
+        stub = contextlib.nullcontext(args.stub_url.rstrip('/'))
+    else:
+        stub = StubServer(StubConfig(latency=args.latency, error_rate=args.error_rate))
+    with stub as server:
+        url = server if args.stub_url else server.url
+        push_admin.initialize_app(BENCH_APP_ID, 'bench-secret', token_server=url + '/oauth2/v3/token',
+                                  push_open_url=url)
+        runners = {
+            'validate': lambda: bench_validate(args.count),
+            'serialize': lambda: bench_serialize(args.count),
+            'template': lambda: bench_template_render(args.count),
+            'send': lambda: bench_send(args.requests, args.threads),
+            'topics': lambda: bench_topics(args.requests, args.threads),
+        }
+        print('{0:<12} {1:>10} {2:>14} {3:>10} {4:>10} {5:>9}'.format(
+            'case', 'count', 'ops/sec', 'p50 ms', 'p99 ms', 'failures'))
+        for case in cases:
+            if case not in runners:
+                parser.error('unknown case {0}'.format(case))
+            result = runners[case]()
+            results['cases'][case] = result
+            print('{0:<12} {1:>10} {2:>14,.0f} {3:>10.3f} {4:>10.3f} {5:>9}'.format(
+                case, result['count'], result['ops_per_sec'], result['p50_ms'], result['p99_ms'],
+                result['failures']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
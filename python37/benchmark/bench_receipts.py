@@ -0,0 +1,111 @@
+# -*-coding:utf-8-*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load test of the delivery receipt receiver: client processes post receipt batches over
+keep-alive connections while the receiver joins them to indexed sends.
+
+Run from the python37 directory:
+    python -m benchmark.bench_receipts --duration 10 --batch 1000 --clients 2 --target 50000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+
+from src.push_admin import messaging
+
+BI_TAGS = 1000
+
+
+def make_body(batch, offset):
+    now_ms = int(time.time() * 1000)
+    statuses = [{'biTag': 'campaign-{0}'.format((offset + i) % BI_TAGS), 'appid': '100000000',
+                 'token': 'token-{0:08d}'.format(offset + i), 'status': 0 if i % 20 else 2,
+                 'timestamp': now_ms, 'requestId': '{0:024d}'.format(offset + i)} for i in range(batch)]
+    return json.dumps({'statuses': statuses}).encode('utf-8')
+
+
+async def _post_loop(port, bodies, deadline, counts):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    index = 0
+    while time.monotonic() < deadline:
+        body = bodies[index % len(bodies)]
+        index += 1
+        writer.write(b'POST /receipts HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+        await reader.readexactly(length)
+        counts[0] += 1
+    writer.close()
+
+
+def _client(port, batch, connections, duration, results):
+    bodies = [make_body(batch, i * batch) for i in range(8)]
+    counts = [0]
+    deadline = time.monotonic() + duration
+
+    async def main():
+        await asyncio.gather(*[_post_loop(port, bodies, deadline, counts) for _ in range(connections)])
+    asyncio.run(main())
+    results.put(counts[0] * batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delivery receipt receiver load test.')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to post receipts')
+    parser.add_argument('--batch', type=int, default=1000, help='receipts per callback body')
+    parser.add_argument('--clients', type=int, default=2, help='client processes')
+    parser.add_argument('--connections', type=int, default=4, help='keep-alive connections per client')
+    parser.add_argument('--target', type=float, default=50000, help='receipts per second to reach, exit 1 below')
+    args = parser.parse_args()
+
+    receiver = messaging.ReceiptReceiver(host='127.0.0.1', port=0, path='/receipts')
+    for i in range(BI_TAGS):
+        receiver.index.add(bi_tag='campaign-{0}'.format(i), sent_at=time.time() - 5)
+    receiver.start_in_thread()
+
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=_client, args=(receiver.port, args.batch, args.connections,
+                                                             args.duration, results))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for process in clients:
+        process.start()
+    posted = sum(results.get() for _ in clients)
+    for process in clients:
+        process.join()
+    elapsed = time.perf_counter() - start
+    receiver.stop_thread()
+
+    stats = receiver.stats()
+    rate = stats['receipts'] / elapsed
+    print('posted {0} receipts, received {1} in {2:.1f}s: {3:,.0f} receipts/s'.format(
+        posted, stats['receipts'], elapsed, rate))
+    print('matched {0}, delivered {1}, statuses {2}, delivery p50 {3:.2f}s p99 {4:.2f}s'.format(
+        stats['matched'], stats['delivered'], stats['statuses'], stats['latency_p50_s'] or 0.0,
+        stats['latency_p99_s'] or 0.0))
+    if rate < args.target:
+        print('below the target of {0:,.0f} receipts/s'.format(args.target))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*-coding:utf-8-*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare rendering personalized request bodies with MessageTemplate against building
+and serializing a Message graph per user.
+
+Run from the python37 directory:
+    python -m benchmark.bench_template [count]
+"""
+
+import json
+import sys
+import time
+
+from src.push_admin import messaging
+from src.push_admin import _message_serializer
+
+
+def build_message(name, body, token):
+    return messaging.Message(
+        notification=messaging.Notification(title='Hello ' + name, body=body),
+        android=messaging.AndroidConfig(
+            urgency=messaging.AndroidConfig.HIGH_PRIORITY,
+            ttl='10000s',
+            notification=messaging.AndroidNotification(
+                title='Hello ' + name,
+                body=body,
+                click_action=messaging.AndroidClickAction(action_type=3),
+                importance=messaging.AndroidNotification.PRIORITY_HIGH)),
+        token=[token])
+
+
+def make_batch(count):
+    return {
+        'name': ['user{0}'.format(i) for i in range(count)],
+        'body': ['Your order #{0} has shipped "today"'.format(i) for i in range(count)],
+        'token': ['token-{0:08d}'.format(i) for i in range(count)],
+    }
+
+
+def bench_per_message(batch):
+    encoder = _message_serializer.MessageSerializer()
+    start = time.perf_counter()
+    for name, body, token in zip(batch['name'], batch['body'], batch['token']):
+        message = build_message(name, body, token)
+        json.dumps({'validate_only': False, 'message': encoder.default(message)})
+    return time.perf_counter() - start
+
+
+def bench_template(batch):
+    start = time.perf_counter()
+    template = messaging.MessageTemplate(build_message('${name}', '${body}', '${token}'))
+    for _ in template.render_batch(batch):
+        pass
+    return time.perf_counter() - start
+
+
+def check_equivalence(batch):
+    encoder = _message_serializer.MessageSerializer()
+    template = messaging.MessageTemplate(build_message('${name}', '${body}', '${token}'))
+    for index, rendered in enumerate(template.render_batch(batch)):
+        if index >= 100:
+            break
+        message = build_message(batch['name'][index], batch['body'][index], batch['token'][index])
+        expected = json.dumps({'validate_only': False, 'message': encoder.default(message)})
+        assert json.loads(rendered) == json.loads(expected), rendered
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    batch = make_batch(count)
+    check_equivalence(batch)
+
+    elapsed = bench_template(batch)
+    print('template   : {0} renders in {1:.2f}s, {2:,.0f} msgs/sec'.format(count, elapsed, count / elapsed))
+
+    baseline_count = min(count, 100000)
+    baseline = bench_per_message(make_batch(baseline_count))
+    print('per message: {0} builds in {1:.2f}s, {2:,.0f} msgs/sec'.format(
+        baseline_count, baseline, baseline_count / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# -*-coding:utf-8-*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local stub of the HCM OAuth and push endpoints for benchmarks:
+
+    POST /oauth2/v3/token
+    POST /v1/{appid}/messages:send
+    POST /v1/{appid}/topic:subscribe
+    POST /v1/{appid}/topic:unsubscribe
+    POST /v1/{appid}/topic:list
+
+Run it standalone from the python37 directory:
+    python -m benchmark.stub_server --port 8080 --latency 0.02
+and point initialize_app(token_server='http://127.0.0.1:8080/oauth2/v3/token',
+push_open_url='http://127.0.0.1:8080') at it.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUCCESS_CODE = '80000000'
+
+_PUSH_PATH = re.compile(r'^/v1/([^/]+)/(messages:send|topic:subscribe|topic:unsubscribe|topic:list)$')
+
+
+class StubConfig(object):
+    """
+    Behaviour of the stub server.
+
+    Args:
+        latency: delay in seconds added to every push request.
+        jitter: random extra delay in seconds, uniform in [0, jitter].
+        token_latency: delay in seconds added to every token request.
+        error_rate: fraction of push requests answered with ``error_code``.
+        error_code: HCM result code returned for failed requests.
+        throttle_rps: maximum push requests per second, requests beyond it get HTTP ``throttle_status``.
+        throttle_status: HTTP status code of throttled requests.
+        token_expires_in: lifetime in seconds of the issued access tokens.
+        illegal_token_prefix: send tokens starting with it are rejected like invalid tokens.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, token_latency=0.0, error_rate=0.0, error_code='80100003',
+                 throttle_rps=None, throttle_status=503, token_expires_in=3600, illegal_token_prefix=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.throttle_rps = throttle_rps
+        self.throttle_status = throttle_status
+        self.token_expires_in = token_expires_in
+        self.illegal_token_prefix = illegal_token_prefix
+
+
+class StubServer(object):
+    """
+    A threaded HTTP server answering like HCM.
+
+        with StubServer(StubConfig(latency=0.01)) as server:
+            push_admin.initialize_app(appid, secret, token_server=server.token_url,
+                                      push_open_url=server.url)
+    """
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StubConfig()
+        self.counters = dict.fromkeys(('token', 'send', 'subscribe', 'unsubscribe', 'list',
+                                       'errors', 'throttled', 'unauthorized'), 0)
+        self.tokens = set()
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    @property
+    def token_url(self):
+        return self.url + '/oauth2/v3/token'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='hcm-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _throttled(self):
+        rps = self.config.throttle_rps
+        if rps is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > rps
+
+    def _sleep(self, latency, jitter=0.0):
+        delay = latency + (random.uniform(0, jitter) if jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _issue_token(self):
+        self._sleep(self.config.token_latency)
+        token = 'stub-token-{0}'.format(next(self._request_ids))
+        with self._lock:
+            self.tokens.add(token)
+            self.counters['token'] += 1
+        return 200, {'access_token': token, 'expires_in': self.config.token_expires_in, 'token_type': 'Bearer'}
+
+    def _handle_push(self, operation, headers, body):
+        authorization = headers.get('Authorization', '')
+        if not authorization.startswith('Bearer ') or authorization[len('Bearer '):] not in self.tokens:
+            self._count('unauthorized')
+            return 401, {'code': '80200003', 'msg': 'OAuth token expired', 'requestId': ''}
+        if self._throttled():
+            self._count('throttled')
+            return self.config.throttle_status, {'code': '80300010', 'msg': 'throttled', 'requestId': ''}
+        self._sleep(self.config.latency, self.config.jitter)
+
+        request_id = '{0:024d}'.format(next(self._request_ids))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self._count('errors')
+            return 400, {'code': '80100001', 'msg': 'illegal request body', 'requestId': request_id}
+
+        name = operation.split(':')[-1] if operation.startswith('topic') else 'send'
+        self._count(name)
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self._count('errors')
+            return 200, {'code': self.config.error_code, 'msg': 'stub error', 'requestId': request_id}
+
+        response = {'code': SUCCESS_CODE, 'msg': 'Success', 'requestId': request_id}
+        if operation in ('topic:subscribe', 'topic:unsubscribe'):
+            tokens = request.get('tokenArray') or []
+            response.update(successCount=len(tokens), failureCount=0, errors=[])
+        elif operation == 'topic:list':
+            response['topics'] = [{'name': 'stub-topic', 'addDate': time.strftime('%Y-%m-%d')}]
+        elif self.config.illegal_token_prefix:
+            response.update(self._check_tokens(request))
+        return 200, response
+
+    def _check_tokens(self, request):
+        tokens = (request.get('message') or {}).get('token') or []
+        illegal = [token for token in tokens if token.startswith(self.config.illegal_token_prefix)]
+        if not illegal:
+            return {}
+        if len(illegal) == len(tokens):
+            return {'code': '80300007', 'msg': 'All the tokens are invalid'}
+        return {'code': '80100000', 'msg': json.dumps({'success': len(tokens) - len(illegal),
+                                                       'failure': len(illegal), 'illegal_tokens': illegal})}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if self.path.endswith('/oauth2/v3/token'):
+                    status, response = server._issue_token()
+                else:
+                    match = _PUSH_PATH.match(self.path)
+                    if match is None:
+                        status, response = 404, {'code': '80100000', 'msg': 'not found', 'requestId': ''}
+                    else:
+                        status, response = server._handle_push(match.group(2), self.headers, body)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_HEAD(self):
+                # the connection probe of App.warm_up, answered without closing the connection
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the HCM OAuth and push endpoints.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every push request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds per push request')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='seconds added to every token request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of failed push requests')
+    parser.add_argument('--error-code', default='80100003', help='HCM result code of failed push requests')
+    parser.add_argument('--throttle-rps', type=int, default=None, help='push requests per second before throttling')
+    parser.add_argument('--throttle-status', type=int, default=503, help='HTTP status of throttled requests')
+    parser.add_argument('--illegal-token-prefix', help='reject send tokens starting with this prefix')
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+                        error_rate=args.error_rate, error_code=args.error_code,
+                        throttle_rps=args.throttle_rps, throttle_status=args.throttle_status,
+                        illegal_token_prefix=args.illegal_token_prefix)
+    server = StubServer(config, host=args.host, port=args.port)
+    print('HCM stub listening on {0}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -16,16 +16,16 @@
 
 """Huawei Admin SDK for Python."""
 
-import threading
 from src.push_admin import _app
+from src.push_admin import _registry
 
-_apps = {}
-_apps_lock = threading.RLock()
+_apps = _registry.AppRegistry()
+_apps_lock = _apps.lock
 _DEFAULT_APP_NAME = 'DEFAULT'
 
 
 def initialize_app(appid_at, appsecret_at, appid_push=None, token_server='https://oauth-login.cloud.huawei.com/oauth2/v3/token',
-                   push_open_url='https://push-api.cloud.huawei.com'):
+                   push_open_url='https://push-api.cloud.huawei.com', warm_up=False):
     """
         Initializes and returns a new App instance.
         :param appid_at: appid parameters obtained by developer alliance applying for Push service
@@ -33,17 +33,71 @@ def initialize_app(appid_at, appsecret_at, appid_push=None, token_server='https:
         :param appid_push: the application Id in the URL
         :param token_server: Oauth server URL
         :param push_open_url: push open API URL
+        :param warm_up: (optional) True, or a number of connections to push_open_url, to fetch the
+            access token and open the connections in the background, see ``App.warm_up``
     """
-    app = _app.App(appid_at, appsecret_at, appid_push, token_server=token_server, push_open_url=push_open_url)
+    # an app initialized explicitly is never evicted, only the apps of the credentials provider are
+    app = _apps.setdefault(appid_at, lambda: _build_app(appid_at, appsecret_at, appid_push, token_server,
+                                                        push_open_url), pin=True)
 
+    """set default app instance"""
     with _apps_lock:
-        if appid_at not in _apps:
-            _apps[appid_at] = app
-
-        """set default app instance"""
         if _apps.get(_DEFAULT_APP_NAME) is None:
+            _apps.pin(_DEFAULT_APP_NAME)
             _apps[_DEFAULT_APP_NAME] = app
 
+    if warm_up:
+        app.warm_up(connections=4 if warm_up is True else warm_up)
+    return app
+
+
+def set_credentials_provider(provider, max_apps=None):
+    """
+        Build apps lazily on their first use instead of calling initialize_app for each of them.
+        :param provider: callable(appid) returning a dict with the keys appsecret_at and, optionally,
+            appid_push, token_server and push_open_url; or None if the app id is unknown
+        :param max_apps: (optional) maximum number of apps kept, the least recently used ones are
+            closed and removed beyond it
+    """
+    _apps.set_credentials_provider(provider, _build_app)
+    _apps.set_max_apps(max_apps)
+
+
+def evict_idle_apps(idle_seconds):
+    """
+        Close and remove the apps which have not been used for idle_seconds.
+        :return: list of evicted app ids
+    """
+    return _apps.evict_idle(idle_seconds)
+
+
+def app_stats():
+    """
+        :return: dict of app id -> resource statistics of the app
+    """
+    return _apps.stats()
+
+
+def refresh_all(max_workers=16, rate=None, force=False, verify_peer=False, timeout=None, app_ids=None):
+    """
+        Refresh the access tokens of all registered apps concurrently, e.g. from a readiness probe
+        after a restart: ``push_admin.refresh_all(max_workers=32, rate=50)['ready']``
+        :param max_workers: maximum number of token requests in flight
+        :param rate: (optional) maximum number of token requests started per second
+        :param force: also refresh the tokens that are still valid
+        :param timeout: (optional) seconds after which the apps not started yet are reported failed
+        :param app_ids: (optional) app ids to refresh instead of the registered apps, apps of the
+            credentials provider are built
+        :return: dict with the per app results under 'apps', the counts of refreshed, skipped and
+            failed apps, 'elapsed_s' and 'ready'
+    """
+    return _apps.refresh_all(max_workers, rate, force, verify_peer, timeout, app_ids)
+
+
+def _build_app(appid_at, appsecret_at, appid_push=None, token_server='https://oauth-login.cloud.huawei.com/oauth2/v3/token',
+               push_open_url='https://push-api.cloud.huawei.com'):
+    return _app.App(appid_at, appsecret_at, appid_push, token_server=token_server, push_open_url=push_open_url)
+
 
 def get_app(appid=None):
     """
@@ -53,19 +107,22 @@ def get_app(appid=None):
         Raise: ValueError
     """
     if appid is None:
-        with _apps_lock:
-            app = _apps.get(_DEFAULT_APP_NAME)
-            if app is None:
-                raise ValueError('The default Huawei app is not exists. '
-                                 'This means you need to call initialize_app() it.')
-            return app
-
-    with _apps_lock:
-        if appid not in _apps:
-            raise ValueError('Huawei app id[{0}] is not exists. '
-                             'This means you need to call initialize_app() it.'.format(appid))
-
-        app = _apps.get(appid)
+        app = _apps.get(_DEFAULT_APP_NAME)
         if app is None:
-            raise ValueError('The app id[{0}] is None.'.format(appid))
+            raise ValueError('The default Huawei app is not exists. '
+                             'This means you need to call initialize_app() it.')
         return app
+
+    app = _apps.lookup(appid)
+    if app is None:
+        raise ValueError('Huawei app id[{0}] is not exists. '
+                         'This means you need to call initialize_app() it.'.format(appid))
+    return app
+
+
+def __getattr__(name):
+    # submodules are imported on first access, e.g. push_admin.messaging without importing it first
+    if name == 'messaging':
+        import importlib
+        return importlib.import_module('src.push_admin.messaging')
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
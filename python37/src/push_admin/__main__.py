@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command line tools: python -m src.push_admin <command> [options]"""
+
+import sys
+
+_COMMANDS = ('loadgen', 'replay')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in _COMMANDS:
+        print('usage: python -m src.push_admin {{{0}}} [options]'.format(','.join(_COMMANDS)))
+        return 2
+    if argv[0] == 'loadgen':
+        from src.push_admin import _loadgen
+        _loadgen.main(argv[1:])
+    elif argv[0] == 'replay':
+        from src.push_admin import _replay
+        _replay.main(argv[1:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
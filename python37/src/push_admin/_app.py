@@ -15,12 +15,18 @@
 # limitations under the License.
 
 import json
+import sys
+import threading
 import time
 import urllib
 import urllib.parse
 
 from src.push_admin import _http
 from src.push_admin import _message_serializer
+from src.push_admin import _messages
+from src.push_admin import _metrics
+from src.push_admin import _topic_index
+from src.push_admin import _tracing
 
 
 class App(object):
@@ -28,21 +34,12 @@ class App(object):
 
     JSON_ENCODER = _message_serializer.MessageSerializer()
 
-    @classmethod
-    def _send_to_server(cls, headers, body, url, verify_peer=False):
-        try:
-            msg_body = json.dumps(body)
-            response = _http.post(url, msg_body, headers, verify_peer)
-
-            if response.status_code is not 200:
-                raise ApiCallError('http status code is {0} in send.'.format(response.status_code))
+    SUCCESS_CODE = '80000000'
 
-            # json text to dict
-            resp_dict = json.loads(response.text)
-            return resp_dict
-
-        except Exception as e:
-            raise ApiCallError('caught exception when send. {0}'.format(e))
+    OPERATION_SEND = 'send'
+    OPERATION_SUBSCRIBE = 'subscribe'
+    OPERATION_UNSUBSCRIBE = 'unsubscribe'
+    OPERATION_LIST = 'list'
 
     def __init__(self, appid_at, app_secret_at, appid_push, token_server='https://oauth-login.cloud.huawei.com/oauth2/v3/token',
                  push_open_url='https://push-api.cloud.huawei.com'):
@@ -61,6 +58,18 @@ class App(object):
         self.hw_push_topic_sub_server = self.push_open_url + "/v1/{0}/topic:subscribe"
         self.hw_push_topic_unsub_server = self.push_open_url + "/v1/{0}/topic:unsubscribe"
         self.hw_push_topic_query_server = self.push_open_url + "/v1/{0}/topic:list"
+        self.topic_index = _topic_index.TopicIndex()
+        self._session = None
+        self._session_lock = threading.Lock()
+        # session -> requests using it, a closed session is released by its last request
+        self._session_users = {}
+        self._retired_sessions = set()
+        self._closed = False
+        self._pool_size = _http.DEFAULT_POOLSIZE
+        self._token_lock = threading.Lock()
+        self._request_count = 0
+        self._token_refresh_count = 0
+        self.warm_up_future = None
 
     def _refresh_token(self, verify_peer=False):
         """refresh access token
@@ -78,8 +87,17 @@ class App(object):
 
         msg_body = urllib.parse.urlencode(params)
 
+        result = 'failure'
+        start = time.perf_counter()
         try:
-            response = _http.post(self.token_server, msg_body, headers, verify_peer=verify_peer)
+            self._token_refresh_count += 1
+            with _tracing.start_span('hcm.token_refresh', app=self.app_id_at):
+                session = self._acquire_session()
+                try:
+                    response = _http.post(self.token_server, msg_body, headers, verify_peer=verify_peer,
+                                          session=session)
+                finally:
+                    self._release_session(session)
 
             if response.status_code is not 200:
                 return False, 'http status code is {0} in get access token'.format(response.status_code)
@@ -90,9 +108,13 @@ class App(object):
             self.access_token = response_body.get('access_token')
             self.token_expired_time = int(round(time.time() * 1000)) + (int(response_body.get('expires_in')) - 5 * 60) * 1000
 
+            result = 'success'
             return True, None
         except Exception as e:
             raise ApiCallError(format(repr(e)))
+        finally:
+            _metrics.TOKEN_REFRESH_SECONDS.labels(self.app_id_at).observe(time.perf_counter() - start)
+            _metrics.TOKEN_REFRESHES.labels(self.app_id_at, result).inc()
 
     def _is_token_expired(self):
         """is access token expired"""
@@ -109,9 +131,248 @@ class App(object):
         :return:
         """
         if self._is_token_expired() is True:
+            # one thread refreshes, concurrent senders wait for its token
+            with self._token_lock:
+                if self._is_token_expired() is True:
+                    result, reason = self._refresh_token(verify_peer)
+                    if result is False:
+                        raise ApiCallError(reason)
+
+    @property
+    def token_expired(self):
+        """True when the next request has to fetch an access token first"""
+        return self._is_token_expired()
+
+    def refresh_token(self, force=False, verify_peer=False):
+        """
+        fetch a new access token when the current one expired, or always with force
+        :param force: refresh a token that is still valid too
+        :param verify_peer: as for the sends
+        :return: True if a token was fetched, False if the token was still valid
+        Raise: ApiCallError
+        """
+        if not force and not self._is_token_expired():
+            return False
+        with self._token_lock:
+            if not force and not self._is_token_expired():
+                # refreshed by a concurrent sender meanwhile
+                return False
             result, reason = self._refresh_token(verify_peer)
             if result is False:
                 raise ApiCallError(reason)
+            return True
+
+    def _get_session(self):
+        """the http session holding the pooled connections of this app"""
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._closed:
+                    raise RuntimeError('Cannot open connections of a closed App.')
+                if self._session is None:
+                    self._session = _http.create_session(self._pool_size)
+                session = self._session
+        return session
+
+    def _acquire_session(self):
+        """the session for one request, released with _release_session once the request is done"""
+        with self._session_lock:
+            session = self._session
+            if session is None:
+                session = _http.create_session(self._pool_size)
+                if self._closed:
+                    # a request of an app already closed, e.g. evicted under a Sender, gets a
+                    # session of its own closed after it, nothing is pooled for nobody to close
+                    self._retired_sessions.add(session)
+                else:
+                    self._session = session
+            self._session_users[session] = self._session_users.get(session, 0) + 1
+        return session
+
+    def _release_session(self, session):
+        with self._session_lock:
+            users = self._session_users[session] - 1
+            if users:
+                self._session_users[session] = users
+                return
+            del self._session_users[session]
+            if session not in self._retired_sessions:
+                return
+            self._retired_sessions.discard(session)
+        session.close()
+
+    def reserve_connections(self, count):
+        """
+        make room for at least count pooled connections per host, e.g. one per sending thread
+        :param count: number of connections used concurrently
+        """
+        with self._session_lock:
+            if count <= self._pool_size:
+                return
+            self._pool_size = count
+            if self._session is not None:
+                _http.mount_pool(self._session, count)
+
+    def warm_up(self, connections=4, token_connections=1, verify_peer=False, timeout=10):
+        """
+        prepare the first sends in the background: fetch the access token, resolve the hosts,
+        open pooled connections and prime the serializer, all in parallel
+        :param connections: connections opened to push_open_url
+        :param token_connections: connections opened to token_server, the token fetch counts as one
+        :param verify_peer: as for the sends, the connections are only reused by sends with the same value
+        :param timeout: timeout of each network step in seconds
+        :return: concurrent.futures.Future of a dict with the connections opened, the seconds
+            each step took and the errors per step, also kept as warm_up_future
+        """
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        self.warm_up_future = future
+        self.reserve_connections(max(connections, token_connections))
+        # the token fetch opens a connection to token_server
+        extra_token_connections = token_connections - 1 if self._is_token_expired() else token_connections
+        report = {'connections': 0, 'token_connections': 0, 'errors': dict()}
+
+        def step(name, function):
+            start = time.perf_counter()
+            try:
+                function()
+            except Exception as e:
+                report['errors'][name] = repr(e)
+            report[name + '_s'] = time.perf_counter() - start
+
+        def resolve():
+            import socket
+            for url in (self.push_open_url, self.token_server):
+                parts = urllib.parse.urlsplit(url)
+                socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+
+        def connect():
+            report['connections'] = _http.open_connections(self._get_session(), self.push_open_url, connections,
+                                                           verify_peer, timeout)
+            if report['connections'] < connections:
+                raise ApiCallError('opened {0} of {1} connections to {2}'.format(
+                    report['connections'], connections, self.push_open_url))
+
+        def connect_token_server():
+            if extra_token_connections > 0:
+                report['token_connections'] = _http.open_connections(
+                    self._get_session(), self.token_server, extra_token_connections, verify_peer, timeout)
+                if report['token_connections'] < extra_token_connections:
+                    raise ApiCallError('opened {0} of {1} connections to {2}'.format(
+                        report['token_connections'], extra_token_connections, self.token_server))
+
+        steps = (('token', lambda: self._update_token(verify_peer)), ('dns', resolve), ('connect', connect),
+                 ('connect_token_server', connect_token_server), ('serializer', _prime_serializer))
+
+        def run():
+            start = time.perf_counter()
+            # the session is created before the steps run, it imports requests
+            try:
+                self._get_session()
+            except Exception as e:
+                # e.g. a closed app, no step could open a connection
+                report['errors']['session'] = repr(e)
+            else:
+                threads = [threading.Thread(target=step, args=item, name='hcm-warm-up', daemon=True)
+                           for item in steps]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            report['elapsed_s'] = time.perf_counter() - start
+            future.set_result(report)
+
+        threading.Thread(target=run, name='hcm-warm-up', daemon=True).start()
+        return future
+
+    def close(self):
+        """
+        release the pooled connections and the access token of this app, the connections of the
+        requests in flight are released when they are done
+        """
+        with self._session_lock:
+            self._closed = True
+            session, self._session = self._session, None
+            if session is not None and session in self._session_users:
+                self._retired_sessions.add(session)
+                session = None
+        if session is not None:
+            session.close()
+        self.access_token = None
+        self.token_expired_time = 0
+
+    def stats(self):
+        """
+        :return: dict of resource statistics of this app
+        """
+        now = int(round(time.time() * 1000))
+        return {
+            'requests': self._request_count,
+            'token_refreshes': self._token_refresh_count,
+            'token_valid_ms': max(0, self.token_expired_time - now) if self.access_token is not None else 0,
+            'session_open': self._session is not None,
+            'pool_size': self._pool_size,
+            'indexed_tokens': len(self.topic_index),
+        }
+
+    def _send_to_server(self, headers, body, url, verify_peer=False, operation=OPERATION_SEND):
+        """
+        post a request to HCM and record its latency per phase: serialize, network and parse
+        :param body: request dict, or JSON text already serialized by the caller
+        :param operation: operation name used in metrics
+        :return: response dict
+        """
+        self._request_count += 1
+        code = 'exception'
+        start = time.perf_counter()
+        with _tracing.start_span('hcm.request', app=self.app_id_at, operation=operation) as span:
+            try:
+                if isinstance(body, str):
+                    msg_body = body
+                else:
+                    msg_body = json.dumps(body)
+                    _metrics.REQUEST_SECONDS.labels(self.app_id_at, operation, 'serialize').observe(
+                        time.perf_counter() - start)
+                span.set_attribute('payload_size', len(msg_body))
+
+                network_start = time.perf_counter()
+                session = self._acquire_session()
+                try:
+                    response = _http.post(url, msg_body, headers, verify_peer, session=session)
+                finally:
+                    self._release_session(session)
+                parse_start = time.perf_counter()
+                _metrics.REQUEST_SECONDS.labels(self.app_id_at, operation, 'network').observe(
+                    parse_start - network_start)
+                # a capture runs only once _capture was imported by start_capture, sends
+                # without one neither import it nor its gzip and hashlib dependencies
+                _capture = sys.modules.get('src.push_admin._capture')
+                recorder = _capture.recorder if _capture is not None else None
+                if recorder is not None:
+                    recorder.record(operation, url, headers, msg_body, response.status_code, response.text,
+                                    parse_start - network_start)
+
+                if response.status_code != 200:
+                    code = 'http_{0}'.format(response.status_code)
+                    raise ApiCallError('http status code is {0} in send.'.format(response.status_code),
+                                       detail=response)
+
+                # json text to dict
+                resp_dict = json.loads(response.text)
+                code = str(resp_dict.get('code'))
+                span.set_attribute('request_id', resp_dict.get('requestId'))
+                _metrics.REQUEST_SECONDS.labels(self.app_id_at, operation, 'parse').observe(
+                    time.perf_counter() - parse_start)
+                return resp_dict
+
+            except Exception as e:
+                raise ApiCallError('caught exception when send. {0}'.format(e), detail=e)
+            finally:
+                span.set_attribute('code', code)
+                _metrics.REQUEST_SECONDS.labels(self.app_id_at, operation, 'total').observe(
+                    time.perf_counter() - start)
+                _metrics.REQUESTS.labels(self.app_id_at, operation, code).inc()
 
     def _create_header(self):
         headers = dict()
@@ -132,14 +393,39 @@ class App(object):
                 ApiCallError: failure reason
         """
         verify_peer = kwargs['verify_peer']
+        with _tracing.start_span('hcm.app.send', app=self.app_id_at, validate_only=validate_only):
+            start = time.perf_counter()
+            msg_body_dict = dict()
+            msg_body_dict['validate_only'] = validate_only
+            msg_body_dict['message'] = App.JSON_ENCODER.default(message)
+            App.JSON_ENCODER.check_payload_size(msg_body_dict['message'])
+            msg_body = json.dumps(msg_body_dict)
+            _metrics.REQUEST_SECONDS.labels(self.app_id_at, App.OPERATION_SEND, 'serialize').observe(
+                time.perf_counter() - start)
+
+            self._update_token(verify_peer)
+            headers = self._create_header()
+            url = self.hw_push_server.format(self.appid_push)
+            return self._send_to_server(headers, msg_body, url, verify_peer)
+
+    def send_serialized(self, body, **kwargs):
+        """
+            Sends an already serialized request body to Huawei Cloud Messaging (HCM)
+            The body is sent as is: its payload size is not checked, the caller checks it
+            when building the body, e.g. with ``JSON_ENCODER.check_payload_size``.
+            :param body: JSON text of the request, i.e. {"validate_only": ..., "message": {...}}
+            :param kwargs:
+                   verify_peer: HTTPS server identity verification, use library 'certifi'
+            :return:
+                response dict: response body dict
+            :raise:
+                ApiCallError: failure reason
+        """
+        verify_peer = kwargs.get('verify_peer', False)
         self._update_token(verify_peer)
         headers = self._create_header()
         url = self.hw_push_server.format(self.appid_push)
-        msg_body_dict = dict()
-        msg_body_dict['validate_only'] = validate_only
-        msg_body_dict['message'] = App.JSON_ENCODER.default(message)
-
-        return App._send_to_server(headers, msg_body_dict, url, verify_peer)
+        return self._send_to_server(headers, body, url, verify_peer)
 
     def subscribe_topic(self, topic, token_list):
         """
@@ -151,7 +437,7 @@ class App(object):
         headers = self._create_header()
         url = self.hw_push_topic_sub_server.format(self.appid_push)
         msg_body_dict = {'topic': topic, 'tokenArray': token_list}
-        return App._send_to_server(headers, msg_body_dict, url)
+        return self._send_to_server(headers, msg_body_dict, url, operation=App.OPERATION_SUBSCRIBE)
 
     def unsubscribe_topic(self, topic, token_list):
         """
@@ -164,7 +450,7 @@ class App(object):
         headers = self._create_header()
         url = self.hw_push_topic_unsub_server.format(self.appid_push)
         msg_body_dict = {'topic': topic, 'tokenArray': token_list}
-        return App._send_to_server(headers, msg_body_dict, url)
+        return self._send_to_server(headers, msg_body_dict, url, operation=App.OPERATION_UNSUBSCRIBE)
 
     def query_subscribe_list(self, token):
         """
@@ -175,7 +461,20 @@ class App(object):
         headers = self._create_header()
         url = self.hw_push_topic_query_server.format(self.appid_push)
         msg_body_dict = {'token': token}
-        return App._send_to_server(headers, msg_body_dict, url)
+        return self._send_to_server(headers, msg_body_dict, url, operation=App.OPERATION_LIST)
+
+
+def _prime_serializer():
+    """serialize a sample message, so that the validation and encoding paths are loaded before the first send"""
+    message = _messages.Message(
+        notification=_messages.Notification(title='warm up', body='warm up'),
+        android=_messages.AndroidConfig(
+            ttl='60s', notification=_messages.AndroidNotification(
+                title='warm up', body='warm up', click_action=_messages.AndroidClickAction(action_type=3))),
+        token=['warm-up'])
+    message_dict = App.JSON_ENCODER.default(message)
+    App.JSON_ENCODER.check_payload_size(message_dict)
+    json.dumps({'validate_only': True, 'message': message_dict})
 
 
 class ApiCallError(Exception):
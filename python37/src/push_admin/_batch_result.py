@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar results of a batch of requests.
+
+One row per request: result code, requestId, latency, chunk index and token count, kept
+in typed arrays instead of one response object per request. Codes are interned, the
+requestIds are concatenated in a single bytearray.
+"""
+
+import array
+import collections
+import csv
+import json
+import math
+import threading
+import time
+
+from src.push_admin import _app
+from src.push_admin import _deadline
+
+COLUMNS = ('chunk', 'code', 'request_id', 'latency_s', 'tokens')
+
+
+class BatchResult(object):
+    """
+    Results of the requests of a campaign, e.g. filled by ``send_chunks``:
+
+        result = messaging.send_chunks(sender, message, tokens)
+        result.wait()
+        result.counts_by_code(), result.failed_chunks(), result.percentiles()
+        result.to_csv('campaign.csv')
+
+    Rows can also be added from any send path with add() or track().
+    """
+    def __init__(self, success_codes=(_app.App.SUCCESS_CODE,)):
+        """
+        :param success_codes: codes of the requests that are not failed
+        """
+        self.success_codes = frozenset(success_codes)
+        self._codes = []
+        self._code_index = dict()
+        self._code = array.array('H')
+        self._chunk = array.array('i')
+        self._latency = array.array('d')
+        self._tokens = array.array('I')
+        self._ids = bytearray()
+        self._id_ends = array.array('Q')
+        self._lock = threading.Condition()
+        self._pending = 0
+
+    def __len__(self):
+        return len(self._code)
+
+    def add(self, code, request_id, latency, chunk=0, tokens=1):
+        """
+        :param code: result code of the request, or the exception name of a failed one
+        :param request_id: requestId of the response, None if there is none
+        :param latency: seconds the request took
+        :param chunk: index of the request in the batch
+        :param tokens: number of tokens of the request
+        """
+        code = str(code)
+        encoded_id = (request_id or '').encode('utf-8')
+        with self._lock:
+            index = self._code_index.get(code)
+            if index is None:
+                index = self._code_index[code] = len(self._codes)
+                self._codes.append(code)
+            self._code.append(index)
+            self._chunk.append(chunk)
+            self._latency.append(latency)
+            self._tokens.append(tokens)
+            self._ids += encoded_id
+            self._id_ends.append(len(self._ids))
+
+    def add_response(self, response, latency, chunk=0, tokens=1):
+        """:param response: a SendResponse, or a response dict"""
+        if isinstance(response, dict):
+            self.add(response.get('code'), response.get('requestId'), latency, chunk, tokens)
+        else:
+            self.add(response.code, response.requestId, latency, chunk, tokens)
+
+    def track(self, future, chunk=0, tokens=1):
+        """
+        Add a row when the future of a SendResponse, e.g. from ``Sender.submit``, is done.
+        The latency is counted from the call to track.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        def done(finished):
+            latency = time.perf_counter() - start
+            try:
+                if finished.cancelled():
+                    self.add('CancelledError', None, latency, chunk, tokens)
+                elif finished.exception() is not None:
+                    self.add(type(finished.exception()).__name__, None, latency, chunk, tokens)
+                else:
+                    self.add_response(finished.result(), latency, chunk, tokens)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if not self._pending:
+                        self._lock.notify_all()
+        future.add_done_callback(done)
+        return future
+
+    def wait(self, timeout=None):
+        """
+        Wait for the tracked futures.
+        :return: True if none is pending anymore
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending, timeout)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def request_id(self, row):
+        start = self._id_ends[row - 1] if row else 0
+        return self._ids[start:self._id_ends[row]].decode('utf-8')
+
+    def __getitem__(self, row):
+        """:return: (chunk, code, request_id, latency_s, tokens) of a row"""
+        if row < 0:
+            row += len(self)
+        return (self._chunk[row], self._codes[self._code[row]], self.request_id(row), self._latency[row],
+                self._tokens[row])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def counts_by_code(self, tokens=False):
+        """
+        :param tokens: count the tokens of the requests instead of the requests
+        :return: dict of code -> count
+        """
+        counts = collections.Counter()
+        if tokens:
+            for index, count in zip(self._code, self._tokens):
+                counts[index] += count
+        else:
+            counts.update(self._code)
+        return dict((self._codes[index], count) for index, count in counts.items())
+
+    def failed_chunks(self):
+        """:return: sorted indexes of the chunks with a request not in success_codes"""
+        failed = set(index for index, code in enumerate(self._codes) if code not in self.success_codes)
+        if not failed:
+            return []
+        return sorted(set(chunk for chunk, code in zip(self._chunk, self._code) if code in failed))
+
+    def percentile(self, q):
+        """:return: q-th percentile of the latency in seconds, None without rows"""
+        return self.percentiles((q,))['p{0}'.format(q)]
+
+    def percentiles(self, qs=(50, 90, 99)):
+        """:return: dict of 'p<q>' -> latency in seconds"""
+        if not self._latency:
+            return dict(('p{0}'.format(q), None) for q in qs)
+        ordered = sorted(self._latency)
+        last = len(ordered) - 1
+        return dict(('p{0}'.format(q), ordered[min(last, max(0, int(math.ceil(q / 100.0 * len(ordered))) - 1))])
+                    for q in qs)
+
+    def summary(self):
+        """:return: dict with requests, tokens, counts by code, failed chunks and latency percentiles"""
+        result = {'requests': len(self), 'tokens': sum(self._tokens), 'codes': self.counts_by_code(),
+                  'failed_chunks': self.failed_chunks()}
+        result.update(self.percentiles())
+        return result
+
+    def to_csv(self, path_or_file):
+        """write the rows with a header line of COLUMNS"""
+        if hasattr(path_or_file, 'write'):
+            self._write_csv(path_or_file)
+            return
+        with open(path_or_file, 'w', newline='', encoding='utf-8') as f:
+            self._write_csv(f)
+
+    def _write_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(self)
+
+    def to_parquet(self, path):
+        """write the rows as a Parquet file, requires the pyarrow package"""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('Parquet export requires the pyarrow package.')
+        codes = pyarrow.DictionaryArray.from_arrays(pyarrow.array(self._code, pyarrow.uint16()),
+                                                    pyarrow.array(self._codes, pyarrow.string()))
+        table = pyarrow.table({
+            'chunk': pyarrow.array(self._chunk, pyarrow.int64()),
+            'code': codes,
+            'request_id': pyarrow.array([self.request_id(row) for row in range(len(self))], pyarrow.string()),
+            'latency_s': pyarrow.array(self._latency, pyarrow.float64()),
+            'tokens': pyarrow.array(self._tokens, pyarrow.int64()),
+        })
+        pyarrow.parquet.write_table(table, path)
+
+    def __repr__(self):
+        return 'BatchResult(requests={0}, pending={1}, codes={2})'.format(
+            len(self), self._pending, self.counts_by_code())
+
+
+def send_chunks(sender, message, tokens, max_body_size=None, max_tokens=None, validate_only=False, result=None):
+    """
+    Send a message to a token audience split into requests of up to max_tokens tokens.
+    :param sender: the ``messaging.Sender`` sending the requests
+    :param message: An instance of ``messaging.Message``, its token is ignored
+    :param tokens: iterable of tokens
+    :param max_body_size: (optional) maximum size of a request body in bytes
+    :param max_tokens: (optional) maximum number of tokens per request, at most 1000
+    :param validate_only: dry run mode
+    :param result: (optional) BatchResult the rows are added to, default a new one
+    :return: the BatchResult, call its wait() for the pending requests
+    """
+    encoder = _app.App.JSON_ENCODER
+    if result is None:
+        result = BatchResult()
+    message_dict = encoder.default(message)
+    encoder.check_payload_size(message_dict)
+    if max_body_size is None:
+        max_body_size = float('inf')
+    priority, ttl = _deadline.message_priority(message), _deadline.message_ttl(message)
+    for chunk, chunk_tokens in enumerate(encoder.split_tokens(message_dict, tokens, max_body_size, max_tokens,
+                                                              validate_only)):
+        body = json.dumps({'validate_only': validate_only, 'message': dict(message_dict, token=chunk_tokens)})
+        result.track(sender.submit_serialized(body, priority=priority, ttl=ttl), chunk, len(chunk_tokens))
+    return result
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-batching of token messages with identical content into multicast requests.
+"""
+
+import collections
+import concurrent.futures
+import json
+import threading
+import time
+from json.encoder import encode_basestring_ascii
+
+from src.push_admin import _app
+from src.push_admin import _deadline
+
+_ENCODER = _app.App.JSON_ENCODER
+_TOKEN_MARK = '__hcm_batch_tokens__'
+
+# HCM codes of a multicast request where some or all tokens were rejected
+_PARTIAL_SUCCESS_CODE = '80100000'
+_ALL_TOKENS_INVALID_CODE = '80300007'
+
+
+class _Batch(object):
+    __slots__ = ('prefix', 'suffix', 'priority', 'ttl', 'deadline', 'tokens', 'token_set', 'size', 'callers')
+
+    def __init__(self, prefix, suffix, priority, ttl, deadline):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.priority = priority
+        self.ttl = ttl
+        self.deadline = deadline
+        self.tokens = []
+        # a token is in a merged request once, so each caller's outcome for it is its own
+        self.token_set = set()
+        self.size = len(prefix) + len(suffix)
+        # (future, token list) of every put merged into this batch
+        self.callers = []
+
+    def body(self):
+        return self.prefix + ', '.join(encode_basestring_ascii(token) for token in self.tokens) + self.suffix
+
+
+def _illegal_tokens(response):
+    """:return: the rejected tokens listed in the msg of a partial success response"""
+    try:
+        detail = json.loads(response.get('msg') or '')
+        return set(detail.get('illegal_tokens') or ())
+    except (ValueError, AttributeError):
+        return None
+
+
+def _caller_response(response, tokens, illegal):
+    """the part of a shared multicast response that concerns one caller's tokens"""
+    if str(response.get('code')) != _PARTIAL_SUCCESS_CODE or illegal is None:
+        return response
+    rejected = [token for token in tokens if token in illegal]
+    if not rejected:
+        return {'code': _app.App.SUCCESS_CODE, 'msg': 'Success', 'requestId': response.get('requestId')}
+    if len(rejected) == len(tokens):
+        return {'code': _ALL_TOKENS_INVALID_CODE, 'msg': 'All the tokens are invalid',
+                'requestId': response.get('requestId')}
+    msg = json.dumps({'success': len(tokens) - len(rejected), 'failure': len(rejected), 'illegal_tokens': rejected})
+    return {'code': _PARTIAL_SUCCESS_CODE, 'msg': msg, 'requestId': response.get('requestId')}
+
+
+class MicroBatcher(object):
+    """
+    Merge token messages whose request bodies are identical apart from the token list into
+    multicast requests of up to max_tokens tokens, sent through a Sender:
+
+        with messaging.Sender() as sender, messaging.MicroBatcher(sender, window=0.05) as batcher:
+            futures = [batcher.put(build_message(token)) for token in tokens]
+
+    A batch is sent when it is full or ``window`` seconds after its first message. Each
+    put gets a future of its own SendResponse: for a partially successful multicast
+    response the code tells whether the caller's tokens were accepted (80000000), all
+    rejected (80300007) or partly rejected (80100000 with the caller's illegal_tokens).
+    Topic and condition messages and messages with more than max_tokens tokens are
+    submitted to the sender unbatched. A token already in the open batch of the same
+    content starts a new batch rather than being merged twice. A put cancelled before its
+    batch is sent leaves its tokens out of the merged request.
+    """
+    def __init__(self, sender, window=0.05, max_tokens=1000, max_body_size=None, max_pending=10000):
+        """
+        :param sender: the ``messaging.Sender`` sending the merged requests
+        :param window: seconds a batch waits for more tokens
+        :param max_tokens: maximum number of tokens of a merged request, at most 1000
+        :param max_body_size: (optional) maximum size of a merged request body in bytes
+        :param max_pending: maximum number of open batches, the oldest is sent early beyond it
+        """
+        if not 1 <= max_tokens <= _ENCODER.MAX_TOKENS:
+            raise ValueError('MicroBatcher max_tokens must be within 1 to {0}.'.format(_ENCODER.MAX_TOKENS))
+        if window < 0:
+            raise ValueError('MicroBatcher window must not be negative.')
+        self.sender = sender
+        self.window = window
+        self.max_tokens = max_tokens
+        self.max_body_size = max_body_size
+        self.max_pending = max_pending
+        # content key -> open batch, in deadline order since the window is constant
+        self._batches = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._messages = 0
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name='hcm-batcher', daemon=True)
+        self._thread.start()
+
+    def put(self, message, validate_only=False):
+        """
+        :param message: An instance of ``messaging.Message``
+        :return: concurrent.futures.Future of the SendResponse for the message's tokens
+        Raise: ValueError if the request body of the message alone exceeds max_body_size
+        """
+        tokens = message.token
+        if not tokens or len(tokens) > self.max_tokens:
+            return self.sender.submit(message, validate_only)
+
+        message_dict = _ENCODER.default(message)
+        _ENCODER.check_payload_size(message_dict)
+        message_dict['token'] = [_TOKEN_MARK]
+        key = json.dumps({'validate_only': validate_only, 'message': message_dict})
+        future = concurrent.futures.Future()
+        tokens_size = sum(len(encode_basestring_ascii(token)) + 2 for token in tokens)
+        if self.max_body_size is not None:
+            size = len(key) - len(encode_basestring_ascii(_TOKEN_MARK)) + tokens_size
+            if size > self.max_body_size:
+                raise ValueError('Request body is {0} bytes, it must not exceed {1} bytes.'.format(
+                    size, self.max_body_size))
+
+        full = []
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Cannot put to a MicroBatcher after close.')
+            self._messages += 1
+            batch = self._batches.get(key)
+            if batch is not None and not self._fits(batch, tokens, tokens_size):
+                full.append(self._batches.pop(key))
+                batch = None
+            if batch is None:
+                prefix, suffix = key.split(encode_basestring_ascii(_TOKEN_MARK))
+                batch = _Batch(prefix, suffix, _deadline.message_priority(message), _deadline.message_ttl(message),
+                               time.monotonic() + self.window)
+                self._batches[key] = batch
+                if len(self._batches) > self.max_pending:
+                    full.append(self._batches.popitem(last=False)[1])
+                if len(self._batches) == 1:
+                    self._condition.notify()
+            batch.tokens.extend(tokens)
+            batch.token_set.update(tokens)
+            batch.size += tokens_size
+            batch.callers.append((future, tokens))
+            if len(batch.tokens) >= self.max_tokens:
+                full.append(self._batches.pop(key))
+            self._requests += len(full)
+        for ready in full:
+            self._submit(ready)
+        return future
+
+    def _fits(self, batch, tokens, tokens_size):
+        if len(batch.tokens) + len(tokens) > self.max_tokens:
+            return False
+        if not batch.token_set.isdisjoint(tokens):
+            return False
+        return self.max_body_size is None or batch.size + tokens_size <= self.max_body_size
+
+    def _submit(self, batch):
+        # claim the callers' futures, the tokens of puts cancelled meanwhile are not sent
+        callers = [(caller, tokens) for caller, tokens in batch.callers if caller.set_running_or_notify_cancel()]
+        if not callers:
+            return
+        if len(callers) < len(batch.callers):
+            batch.tokens = [token for _, tokens in callers for token in tokens]
+        try:
+            future = self.sender.submit_serialized(batch.body(), priority=batch.priority, ttl=batch.ttl)
+        except Exception as e:
+            for caller, _ in callers:
+                caller.set_exception(e)
+            return
+
+        def fan_out(done):
+            if done.cancelled():
+                # claimed futures can no longer be cancelled
+                for caller, _ in callers:
+                    caller.set_exception(concurrent.futures.CancelledError())
+                return
+            if done.exception() is not None:
+                for caller, _ in callers:
+                    caller.set_exception(done.exception())
+                return
+            shared = done.result()
+            response = {'code': shared.code, 'msg': shared.reason, 'requestId': shared.requestId}
+            illegal = _illegal_tokens(response) if str(shared.code) == _PARTIAL_SUCCESS_CODE else None
+            for caller, tokens in callers:
+                part = _caller_response(response, tokens, illegal)
+                caller.set_result(shared if part is response else type(shared)(part))
+        future.add_done_callback(fan_out)
+
+    def _take_due(self, now):
+        due = []
+        while self._batches:
+            batch = next(iter(self._batches.values()))
+            if batch.deadline > now and not self._closed:
+                break
+            due.append(self._batches.popitem(last=False)[1])
+        self._requests += len(due)
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    due = self._take_due(time.monotonic())
+                    if due or (self._closed and not self._batches):
+                        break
+                    timeout = None
+                    if self._batches:
+                        timeout = next(iter(self._batches.values())).deadline - time.monotonic()
+                    self._condition.wait(timeout)
+                closed = self._closed
+            # submit outside the lock, the sender may block on backpressure
+            for batch in due:
+                self._submit(batch)
+            if closed and not due:
+                return
+
+    def stats(self):
+        """
+        :return: dict with open batches, batched messages and merged requests sent
+        """
+        return {'pending': len(self._batches), 'messages': self._messages, 'requests': self._requests}
+
+    def close(self):
+        """send the open batches and stop, the sender is left running"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Capture of HCM requests for offline replay.
+
+While a capture is started every request posted by ``App._send_to_server`` is appended
+to a gzip file of JSON lines, one record per request:
+
+    {"t": wall clock start, "op": operation, "url": url, "h": request headers, "b": request body,
+     "s": http status, "r": response body, "l": network latency in seconds}
+
+The Authorization header is redacted; token requests are never captured since their body
+holds the app secret. Push tokens are personal data: by default every push token in the
+request and response bodies is replaced by a pseudonym, 'redacted-' and a hash of the
+token, so a capture keeps the shape and the token identities of the traffic and replays
+against the stub. Start a capture with redact_tokens=False only where the file is handled
+like the token database itself. Replay a capture with ``python -m src.push_admin replay``.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+REDACTED = '<redacted>'
+TOKEN_PSEUDONYM_PREFIX = 'redacted-'
+
+# request keys holding push tokens: message.token of sends, tokenArray and token of topic requests
+_TOKEN_LIST_KEYS = ('token', 'tokenArray')
+
+
+def pseudonym(token):
+    """:return: the stable pseudonym a push token is captured as"""
+    if not isinstance(token, str):
+        return token
+    return TOKEN_PSEUDONYM_PREFIX + hashlib.blake2b(token.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _redact_tokens(container):
+    for key in _TOKEN_LIST_KEYS:
+        value = container.get(key)
+        if isinstance(value, list):
+            container[key] = [pseudonym(token) for token in value]
+        elif isinstance(value, str):
+            container[key] = pseudonym(value)
+
+
+def redact_body(body):
+    """:return: the JSON text of a request body with its push tokens replaced by pseudonyms"""
+    try:
+        request = json.loads(body)
+    except (TypeError, ValueError):
+        # not JSON, e.g. form data, keep nothing that could hold a token
+        return REDACTED
+    if not isinstance(request, dict):
+        return REDACTED
+    _redact_tokens(request)
+    if isinstance(request.get('message'), dict):
+        _redact_tokens(request['message'])
+    return json.dumps(request)
+
+
+def redact_response(text):
+    """:return: the JSON text of a response body with its illegal tokens replaced by pseudonyms"""
+    try:
+        response = json.loads(text)
+        detail = json.loads(response.get('msg') or '')
+    except (TypeError, ValueError, AttributeError):
+        return text
+    if not isinstance(detail, dict) or not detail.get('illegal_tokens'):
+        return text
+    detail['illegal_tokens'] = [pseudonym(token) for token in detail['illegal_tokens']]
+    response['msg'] = json.dumps(detail)
+    return json.dumps(response)
+
+
+# the active Recorder, read without a lock on the send path
+recorder = None
+_recorder_lock = threading.Lock()
+
+
+class Recorder(object):
+    """append request records to a capture file"""
+    def __init__(self, path, flush_every=100, redact_tokens=True):
+        """
+        :param path: capture file, appended to if it exists
+        :param flush_every: records written between two flushes of the compressed stream
+        :param redact_tokens: replace the push tokens of the bodies by pseudonyms
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.redact_tokens = redact_tokens
+        self.count = 0
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, operation, url, headers, body, status, response_text, latency):
+        headers = dict(headers or ())
+        if 'Authorization' in headers:
+            headers['Authorization'] = REDACTED
+        if self.redact_tokens:
+            body = redact_body(body)
+            response_text = redact_response(response_text)
+        line = json.dumps({'t': time.time() - latency, 'op': operation, 'url': url, 'h': headers, 'b': body,
+                           's': status, 'r': response_text, 'l': round(latency, 6)}, separators=(',', ':'))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self.count += 1
+            if self.count % self.flush_every == 0:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def start(path, flush_every=100, redact_tokens=True):
+    """
+    Start capturing the requests of all apps into path.
+    :param redact_tokens: replace the push tokens by pseudonyms, disable only for a file kept
+        as safe as the tokens themselves
+    :return: the Recorder
+    """
+    global recorder
+    with _recorder_lock:
+        if recorder is not None:
+            raise ValueError('A capture is already running into {0}.'.format(recorder.path))
+        recorder = Recorder(path, flush_every, redact_tokens)
+        return recorder
+
+
+def stop():
+    """
+    Stop capturing and close the capture file.
+    :return: number of records written, 0 if no capture was running
+    """
+    global recorder
+    with _recorder_lock:
+        current, recorder = recorder, None
+    if current is None:
+        return 0
+    current.close()
+    return current.count
+
+
+def read(path):
+    """
+    :return: generator of the records of a capture file, in capture order; a record cut
+        off by a crash ends the generator
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, OSError):
+                return
+            if not line:
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coalescing of collapsible notifications in front of a Sender.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+def coalesce_key(message):
+    """
+    :return: (target, collapse id) of a message a newer one replaces on the device, or None.
+        The target is the token list, topic or condition; the collapse id is
+        AndroidConfig.collapse_key, else AndroidNotification.tag.
+    """
+    android = message.android
+    if android is None:
+        return None
+    collapse = None
+    if android.collapse_key is not None and android.collapse_key != -1:
+        collapse = ('collapse_key', android.collapse_key)
+    elif android.notification is not None and android.notification.tag is not None:
+        collapse = ('tag', android.notification.tag)
+    if collapse is None:
+        return None
+    if message.token:
+        target = ('token', tuple(message.token))
+    elif message.topic is not None:
+        target = ('topic', message.topic)
+    else:
+        target = ('condition', message.condition)
+    return target, collapse
+
+
+class _Slot(object):
+    __slots__ = ('message', 'validate_only', 'deadline', 'future')
+
+    def __init__(self, message, validate_only, deadline):
+        self.message = message
+        self.validate_only = validate_only
+        self.deadline = deadline
+        self.future = concurrent.futures.Future()
+
+
+class CoalescingQueue(object):
+    """
+    Hold collapsible messages for a window and send only the latest one per
+    (token or topic, collapse_key or tag):
+
+        with messaging.Sender() as sender, messaging.CoalescingQueue(sender, window=2.0) as updates:
+            for score in scores:
+                updates.put(build_score_message(score))
+
+    A message is sent at most ``window`` seconds after the first pending message of its key.
+    Every put of the same key shares one future, resolved with the response of the message
+    finally sent; once cancelled, the pending message is not sent. Messages without collapse_key or tag are submitted to the sender at once.
+    """
+    def __init__(self, sender, window=1.0, max_pending=100000):
+        """
+        :param sender: the ``messaging.Sender`` sending the coalesced messages
+        :param window: seconds a message waits for a newer one of its key
+        :param max_pending: maximum number of pending keys, the oldest is sent early beyond it
+        """
+        if window < 0:
+            raise ValueError('CoalescingQueue window must not be negative.')
+        if max_pending < 1:
+            raise ValueError('CoalescingQueue max_pending must be positive.')
+        self.sender = sender
+        self.window = window
+        self.max_pending = max_pending
+        # key -> slot; insertion order is deadline order since the window is constant
+        self._slots = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._coalesced = 0
+        self._sent = 0
+        self._passed_through = 0
+        self._thread = threading.Thread(target=self._run, name='hcm-coalescer', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def put(self, message, validate_only=False):
+        """
+        :param message: An instance of ``messaging.Message``
+        :return: concurrent.futures.Future of the SendResponse
+        """
+        key = coalesce_key(message)
+        if key is None:
+            with self._condition:
+                self._check_open()
+                self._passed_through += 1
+            return self.sender.submit(message, validate_only)
+
+        overflow = None
+        with self._condition:
+            self._check_open()
+            slot = self._slots.get(key)
+            if slot is not None and not slot.future.cancelled():
+                slot.message = message
+                slot.validate_only = validate_only
+                self._coalesced += 1
+                return slot.future
+            if slot is not None:
+                # cancelled by its callers, the new message starts a new window
+                del self._slots[key]
+            slot = _Slot(message, validate_only, time.monotonic() + self.window)
+            self._slots[key] = slot
+            if len(self._slots) > self.max_pending:
+                overflow = self._slots.popitem(last=False)[1]
+                self._sent += 1
+            elif len(self._slots) == 1:
+                self._condition.notify()
+        if overflow is not None:
+            self._submit(overflow)
+        return slot.future
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError('Cannot put to a CoalescingQueue after close.')
+
+    def _submit(self, slot):
+        target = slot.future
+        if not target.set_running_or_notify_cancel():
+            # cancelled by the callers while it was pending, nothing to send
+            return
+        try:
+            future = self.sender.submit(slot.message, slot.validate_only)
+        except Exception as e:
+            target.set_exception(e)
+            return
+
+        def forward(done):
+            # the target is running, the callers cannot cancel it anymore
+            if done.cancelled():
+                target.set_exception(concurrent.futures.CancelledError())
+            elif done.exception() is not None:
+                target.set_exception(done.exception())
+            else:
+                target.set_result(done.result())
+        future.add_done_callback(forward)
+
+    def _take_due(self, now):
+        due = []
+        while self._slots:
+            slot = next(iter(self._slots.values()))
+            if slot.deadline > now and not self._closed:
+                break
+            due.append(self._slots.popitem(last=False)[1])
+            self._sent += 1
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    due = self._take_due(time.monotonic())
+                    if due or (self._closed and not self._slots):
+                        break
+                    timeout = None
+                    if self._slots:
+                        timeout = next(iter(self._slots.values())).deadline - time.monotonic()
+                    self._condition.wait(timeout)
+                closed = self._closed
+            # submit outside the lock, the sender may block on backpressure
+            for slot in due:
+                self._submit(slot)
+            if closed and not due:
+                return
+
+    def flush(self):
+        """send all pending messages now"""
+        with self._condition:
+            due = list(self._slots.values())
+            self._slots.clear()
+            self._sent += len(due)
+        for slot in due:
+            self._submit(slot)
+
+    def stats(self):
+        """
+        :return: dict with pending keys, coalesced (replaced) messages, sent and passed through messages
+        """
+        return {'pending': len(self._slots), 'coalesced': self._coalesced, 'sent': self._sent,
+                'passed_through': self._passed_through}
+
+    def close(self):
+        """send the pending messages and stop, the sender is left running"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compiler for HCM condition expressions, e.g.
+
+    "'TopicA' in topics && ('TopicB' in topics || !('TopicC' in topics))"
+
+Grammar:
+    expr  := term ('||' term)*
+    term  := unary ('&&' unary)*
+    unary := '!' unary | '(' expr ')' | TOPIC 'in' 'topics'
+"""
+
+import functools
+import re
+
+MAX_TOPICS = 5
+MAX_CONDITION_LENGTH = 4096
+
+_TOPIC_PATTERN = re.compile(r'^[a-zA-Z0-9\-_.~%]{1,900}\Z')
+_TOKEN_PATTERN = re.compile(r"""\s*(?:(&&|\|\||!|\(|\))|'([^']*)'|"([^"]*)"|([A-Za-z_]\w*)|(\S))""")
+
+_TOPIC = 'topic'
+_NOT = 'not'
+_AND = 'and'
+_OR = 'or'
+
+
+class ConditionExpression(object):
+    """
+    A compiled condition expression.
+    The syntax tree is made of tuples: ('topic', name), ('not', node), ('and', [nodes]), ('or', [nodes]).
+    """
+    def __init__(self, condition, tree, topics):
+        self.condition = condition
+        self.tree = tree
+        self.topics = topics
+
+    def __repr__(self):
+        return 'ConditionExpression({0!r})'.format(self.condition)
+
+    def matches(self, topics):
+        """
+        :param topics: the topic names a single token is subscribed to
+        :return: whether the token is selected by the condition
+        """
+        return _match(self.tree, topics)
+
+    def evaluate(self, topic_index, tokens=None):
+        """
+        Select the tokens of a topic index that satisfy the condition, using set algebra
+        over the subscribers of each topic instead of testing tokens one by one.
+        :param topic_index: a ``TopicIndex``
+        :param tokens: (optional) restrict the evaluation to these tokens, default all indexed tokens
+        :return: (matched, unknown) sets of tokens; unknown tokens have no fresh and complete entry
+            in the index, a '!' or '&&' over an entry missing topics would select wrong tokens
+        """
+        universe, members = topic_index.snapshot(self.topics, tokens, complete_only=True)
+        matched = _evaluate(self.tree, universe, members)
+        if tokens is None:
+            tokens = topic_index.tokens()
+        return matched, set(tokens) - universe
+
+    def estimate_audience(self, topic_index):
+        """
+        Estimate the number of indexed tokens selected by the condition from the per topic
+        counts only, assuming topics are subscribed independently.
+        :param topic_index: a ``TopicIndex``
+        :return: estimated number of tokens
+        """
+        topic_index.purge_expired()
+        total = len(topic_index)
+        if total == 0:
+            return 0
+        probabilities = dict((topic, min(1.0, topic_index.topic_count(topic) / float(total)))
+                             for topic in self.topics)
+        return int(round(_probability(self.tree, probabilities) * total))
+
+
+def compile_condition(condition):
+    """
+    Parse and check a condition expression.
+    :param condition: the condition string of a message
+    :return: ConditionExpression
+    Raise: ValueError if the condition is malformed or exceeds the limits
+    """
+    # checked before the cache, which would raise TypeError for an unhashable value
+    if not isinstance(condition, str) or not condition.strip():
+        raise ValueError('Message.condition must be a non-empty string.')
+    return _compile(condition)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(condition):
+    if len(condition) > MAX_CONDITION_LENGTH:
+        raise ValueError('Message.condition must not be longer than {0} characters.'.format(MAX_CONDITION_LENGTH))
+
+    parser = _Parser(_tokenize(condition))
+    tree = parser.parse_expr()
+    if parser.peek() is not None:
+        raise ValueError('Message.condition has unexpected {0!r}.'.format(parser.peek()[1]))
+    if parser.topic_count > MAX_TOPICS:
+        raise ValueError('Message.condition must not contain more than {0} topics.'.format(MAX_TOPICS))
+    return ConditionExpression(condition, tree, frozenset(parser.topics))
+
+
+def _tokenize(condition):
+    tokens = []
+    position = 0
+    condition = condition.rstrip()
+    while position < len(condition):
+        match = _TOKEN_PATTERN.match(condition, position)
+        if match is None:
+            break
+        operator, single_quoted, double_quoted, word, other = match.groups()
+        if operator is not None:
+            tokens.append(('op', operator))
+        elif single_quoted is not None or double_quoted is not None:
+            topic = single_quoted if single_quoted is not None else double_quoted
+            if not _TOPIC_PATTERN.match(topic):
+                raise ValueError('Message.condition has an invalid topic name {0!r}.'.format(topic))
+            tokens.append(('topic', topic))
+        elif word is not None:
+            tokens.append(('word', word))
+        else:
+            raise ValueError('Message.condition has unexpected {0!r} at {1}.'.format(other, match.start(5)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.topic_count = 0
+        self.topics = set()
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self, expected=None):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Message.condition ends unexpectedly.')
+        if expected is not None and token != expected:
+            raise ValueError('Message.condition expects {0!r} but got {1!r}.'.format(expected[1], token[1]))
+        self.position += 1
+        return token
+
+    def parse_expr(self):
+        nodes = [self.parse_term()]
+        while self.peek() == ('op', '||'):
+            self.next()
+            nodes.append(self.parse_term())
+        return nodes[0] if len(nodes) == 1 else (_OR, nodes)
+
+    def parse_term(self):
+        nodes = [self.parse_unary()]
+        while self.peek() == ('op', '&&'):
+            self.next()
+            nodes.append(self.parse_unary())
+        return nodes[0] if len(nodes) == 1 else (_AND, nodes)
+
+    def parse_unary(self):
+        token = self.next()
+        if token == ('op', '!'):
+            return _NOT, self.parse_unary()
+        if token == ('op', '('):
+            node = self.parse_expr()
+            self.next(('op', ')'))
+            return node
+        if token[0] == 'topic':
+            self.next(('word', 'in'))
+            self.next(('word', 'topics'))
+            self.topic_count += 1
+            self.topics.add(token[1])
+            return _TOPIC, token[1]
+        raise ValueError('Message.condition has unexpected {0!r}.'.format(token[1]))
+
+
+def _match(node, topics):
+    kind = node[0]
+    if kind == _TOPIC:
+        return node[1] in topics
+    if kind == _NOT:
+        return not _match(node[1], topics)
+    if kind == _AND:
+        return all(_match(child, topics) for child in node[1])
+    return any(_match(child, topics) for child in node[1])
+
+
+def _evaluate(node, universe, members):
+    kind = node[0]
+    if kind == _TOPIC:
+        return members[node[1]]
+    if kind == _NOT:
+        return universe - _evaluate(node[1], universe, members)
+    if kind == _AND:
+        children = sorted((_evaluate(child, universe, members) for child in node[1]), key=len)
+        return children[0].intersection(*children[1:])
+    result = set()
+    for child in node[1]:
+        result |= _evaluate(child, universe, members)
+    return result
+
+
+def _probability(node, probabilities):
+    kind = node[0]
+    if kind == _TOPIC:
+        return probabilities[node[1]]
+    if kind == _NOT:
+        return 1.0 - _probability(node[1], probabilities)
+    if kind == _AND:
+        result = 1.0
+        for child in node[1]:
+            result *= _probability(child, probabilities)
+        return result
+    result = 1.0
+    for child in node[1]:
+        result *= 1.0 - _probability(child, probabilities)
+    return 1.0 - result
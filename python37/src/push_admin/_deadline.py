@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Message TTLs, priorities and the priority lanes of the dispatch queue.
+"""
+
+import heapq
+import itertools
+import re
+import threading
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+LANE_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+DEFAULT_LANE_WEIGHTS = {PRIORITY_HIGH: 8, PRIORITY_NORMAL: 2, PRIORITY_LOW: 1}
+
+# HCM keeps a message for one day when the request sets no ttl
+DEFAULT_TTL = 86400.0
+
+_ANDROID_TTL = re.compile(r'^\s*(\d+(?:\.\d+)?)s\s*$')
+_WEBPUSH_TTL = re.compile(r'^\s*(\d+)\s*$')
+
+
+def parse_ttl(value, pattern=_ANDROID_TTL):
+    """
+    :param value: AndroidConfig.ttl such as '86400s', or WebPushHeader.ttl such as '990'
+        with pattern=_WEBPUSH_TTL
+    :return: the ttl in seconds, None if value is None or malformed
+    """
+    if value is None:
+        return None
+    match = pattern.match(value)
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+def message_ttl(message):
+    """
+    :return: seconds the message stays deliverable on its longest lived platform; platforms
+        without a ttl and messages without platform options get HCM's default of one day
+    """
+    ttls = []
+    if message.android is not None:
+        ttl = parse_ttl(message.android.ttl)
+        ttls.append(DEFAULT_TTL if ttl is None else ttl)
+    headers = message.web_push.headers if message.web_push is not None else None
+    if headers is not None:
+        ttl = parse_ttl(headers.ttl, _WEBPUSH_TTL)
+        ttls.append(DEFAULT_TTL if ttl is None else ttl)
+    elif message.web_push is not None:
+        ttls.append(DEFAULT_TTL)
+    if message.apns is not None or not ttls:
+        ttls.append(DEFAULT_TTL)
+    return max(ttls)
+
+
+def message_priority(message):
+    """
+    :return: PRIORITY_HIGH if any platform asks for high urgency or importance, PRIORITY_LOW if
+        the platforms ask for low importance or urgency only, else PRIORITY_NORMAL
+    """
+    levels = []
+    android = message.android
+    if android is not None:
+        importance = android.notification.importance if android.notification is not None else None
+        if android.urgency == 'HIGH' or importance == 'HIGH':
+            levels.append(PRIORITY_HIGH)
+        elif importance == 'LOW':
+            levels.append(PRIORITY_LOW)
+        else:
+            levels.append(PRIORITY_NORMAL)
+    headers = message.web_push.headers if message.web_push is not None else None
+    if headers is not None and headers.urgency is not None:
+        urgency = headers.urgency.lower()
+        if urgency == 'high':
+            levels.append(PRIORITY_HIGH)
+        elif urgency in ('low', 'very-low'):
+            levels.append(PRIORITY_LOW)
+        else:
+            levels.append(PRIORITY_NORMAL)
+    apns_headers = message.apns.headers if message.apns is not None else None
+    if isinstance(apns_headers, dict) and apns_headers.get('apns-priority') is not None:
+        levels.append(PRIORITY_HIGH if str(apns_headers['apns-priority']) == '10' else PRIORITY_NORMAL)
+    return min(levels) if levels else PRIORITY_NORMAL
+
+
+class LaneQueue(object):
+    """
+    A blocking queue with one lane per priority. Within a lane items are ordered by deadline,
+    then arrival; across lanes smooth weighted round robin picks the lane, so a busy low lane
+    still gets its share and a busy high lane cannot starve the others.
+    """
+    def __init__(self, weights):
+        """
+        :param weights: dict of priority -> positive weight, one lane per priority
+        """
+        if not weights or min(weights.values()) <= 0:
+            raise ValueError('Lane weights must be positive.')
+        self.weights = dict(weights)
+        self._heaps = dict((lane, []) for lane in self.weights)
+        self._credits = dict.fromkeys(self.weights, 0)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def lane_length(self, lane):
+        return len(self._heaps[lane])
+
+    def put(self, item, lane=PRIORITY_NORMAL, deadline=float('inf')):
+        with self._condition:
+            heapq.heappush(self._heaps[lane], (deadline, next(self._sequence), item))
+            # getters may be restricted to some lanes, wake them all
+            self._condition.notify_all()
+
+    def put_many(self, entries):
+        """
+        :param entries: iterable of (item, lane, deadline), queued under one lock acquisition
+        """
+        with self._condition:
+            for item, lane, deadline in entries:
+                heapq.heappush(self._heaps[lane], (deadline, next(self._sequence), item))
+            self._condition.notify_all()
+
+    def get(self, lanes=None):
+        """
+        :param lanes: (optional) the lanes to take from, default all
+        :return: (lane, item), waiting for one; None once the queue is closed and the lanes are empty
+        """
+        lanes = self.weights if lanes is None else lanes
+        with self._condition:
+            while True:
+                ready = [lane for lane in lanes if self._heaps[lane]]
+                if ready:
+                    lane = self._pick(ready)
+                    return lane, heapq.heappop(self._heaps[lane])[2]
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def _pick(self, ready):
+        if len(ready) == 1:
+            return ready[0]
+        total = 0
+        for lane in ready:
+            self._credits[lane] += self.weights[lane]
+            total += self.weights[lane]
+        lane = max(ready, key=self._credits.get)
+        self._credits[lane] -= total
+        return lane
+
+    def drain(self):
+        """:return: all queued (lane, item) pairs, the queue is left empty"""
+        with self._condition:
+            heaps = self._heaps
+            self._heaps = dict((lane, []) for lane in self.weights)
+        return [(lane, entry[2]) for lane, heap in heaps.items() for entry in sorted(heap)]
+
+    def close(self):
+        """wake up the waiting getters once the remaining items are taken"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
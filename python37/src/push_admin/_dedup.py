@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Suppression of duplicate sends within a time window.
+
+A send is keyed per target by (app, token, content hash or idempotency key); the keys of
+the sends accepted by HCM are added to a rotating set of Bloom filters. Memory is fixed
+by the capacity and error rate whatever the number of sends, at the price of a false
+positive rate: about error_rate of the new sends are taken for duplicates.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import math
+import threading
+import time
+
+from src import push_admin
+from src.push_admin import messaging
+from src.push_admin import _app
+from src.push_admin import _deadline
+from src.push_admin import _metrics
+from src.push_admin._batcher import _illegal_tokens, _PARTIAL_SUCCESS_CODE
+
+_ENCODER = _app.App.JSON_ENCODER
+
+SUPPRESSED_MSG = 'Suppressed duplicate'
+
+SUPPRESSED = _metrics.REGISTRY.counter(
+    'hcm_dedup_suppressed_total', 'Token sends suppressed as duplicates.', ('app',))
+ROTATIONS = _metrics.REGISTRY.counter(
+    'hcm_dedup_rotations_total', 'Filter slices started before their time, and slices dropped inside the window.',
+    ('reason',))
+
+
+class BloomFilter(object):
+    """fixed size Bloom filter of byte string keys"""
+    def __init__(self, capacity, error_rate):
+        """
+        :param capacity: number of keys the error rate holds for
+        :param error_rate: false positive rate at capacity
+        """
+        if capacity < 1:
+            raise ValueError('BloomFilter capacity must be positive.')
+        if not 0 < error_rate < 1:
+            raise ValueError('BloomFilter error_rate must be within 0 and 1.')
+        self.capacity = capacity
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, key):
+        # double hashing: position i is h1 + i * h2, from one 128 bit digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        array = self._array
+        return all(array[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        array = self._array
+        for p in self._positions(key):
+            array[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    @property
+    def size(self):
+        """memory of the bit array in bytes"""
+        return len(self._array)
+
+
+class RotatingFilter(object):
+    """
+    Bloom filters of consecutive time slices covering at least ``window`` seconds.
+    Keys are added to the newest slice. A new slice starts every window / (generations - 1)
+    seconds, or early when the newest one reached its capacity so the error rate holds;
+    a slice is dropped once all its keys are older than the window. A burst above the
+    expected rate thus takes extra slices, up to max_generations; beyond it the oldest
+    slice is dropped inside the window, which is counted in window_shortened and logged.
+    """
+    def __init__(self, window, capacity, error_rate=0.001, generations=2, max_generations=None):
+        """
+        :param window: seconds a key is remembered for at least
+        :param capacity: keys per slice, i.e. the sends expected in window / (generations - 1)
+        :param error_rate: false positive rate of each slice at capacity
+        :param generations: number of slices at the expected rate, at least 2
+        :param max_generations: (optional) maximum number of slices, default 4 * generations
+        """
+        if window <= 0:
+            raise ValueError('RotatingFilter window must be positive.')
+        if generations < 2:
+            raise ValueError('RotatingFilter needs at least 2 generations.')
+        if max_generations is None:
+            max_generations = 4 * generations
+        if max_generations < generations:
+            raise ValueError('RotatingFilter max_generations must be at least generations.')
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.slice = window / (generations - 1)
+        self.max_generations = max_generations
+        self.early_rotations = 0
+        self.window_shortened = 0
+        # (start time, filter) of the slices, newest first
+        self._filters = [(time.monotonic(), BloomFilter(capacity, error_rate))]
+        self._lock = threading.Lock()
+
+    def _rotate(self, now):
+        started, newest = self._filters[0]
+        if now - started >= self.slice:
+            # slices stay on the grid of the first one, idle slices are skipped
+            started += int((now - started) / self.slice) * self.slice
+        elif len(newest) >= self.capacity:
+            started = now
+            self.early_rotations += 1
+            ROTATIONS.labels('early').inc()
+        else:
+            return
+        filters = self._filters
+        filters.insert(0, (started, BloomFilter(self.capacity, self.error_rate)))
+        # the keys of a slice are older than the start of the next newer slice
+        horizon = now - self.window
+        while len(filters) > 1 and filters[-2][0] <= horizon:
+            filters.pop()
+        if len(filters) > self.max_generations:
+            filters.pop()
+            self.window_shortened += 1
+            ROTATIONS.labels('window_shortened').inc()
+            import logging
+            logging.getLogger(__name__).warning(
+                'Dedup filter dropped a slice inside its %ss window, the send rate is above %s keys per %ss '
+                'over %s slices.', self.window, self.capacity, self.slice, self.max_generations)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._rotate(time.monotonic())
+            return any(key in f for _, f in self._filters)
+
+    def add(self, key):
+        with self._lock:
+            self._rotate(time.monotonic())
+            self._filters[0][1].add(key)
+
+    @property
+    def size(self):
+        """memory of the filters in bytes"""
+        return sum(f.size for _, f in self._filters)
+
+
+class Deduplicator(object):
+    """
+    Drop the tokens of a send already sent the same content within the window:
+
+        dedup = messaging.Deduplicator(window=3600, capacity=10000000)
+        response = dedup.send(message, idempotency_key=event_id)
+
+    The key of each token is (app, token, idempotency_key) when the caller gives one,
+    else (app, token, hash of the message content); topic and condition messages are
+    keyed by their topic or condition. Only the tokens accepted by HCM are remembered,
+    so a failed send can be retried; two duplicates sent concurrently both go out.
+    When every token is a duplicate nothing is sent and the response has the success
+    code with SUPPRESSED_MSG as reason.
+    """
+    def __init__(self, window=3600, capacity=1000000, error_rate=0.001, generations=2, max_generations=None):
+        """
+        :param window: seconds a send is remembered for at least
+        :param capacity: token sends expected per window / (generations - 1)
+        :param error_rate: rate of new sends taken for duplicates
+        :param generations: number of filter slices, more slices keep the window tighter
+        :param max_generations: (optional) maximum number of slices during bursts, default 4 * generations
+        """
+        self.filter = RotatingFilter(window, capacity, error_rate, generations, max_generations)
+        self.suppressed = 0
+        self.passed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _targets(message_dict):
+        if message_dict.get('token'):
+            return [('token', token) for token in message_dict['token']]
+        if message_dict.get('topic') is not None:
+            return [('topic', message_dict['topic'])]
+        return [('condition', message_dict.get('condition'))]
+
+    def _prepare(self, message, validate_only, app_id, idempotency_key):
+        """:return: (body to send or None, keys of the fresh targets, fresh targets)"""
+        message_dict = _ENCODER.default(message)
+        _ENCODER.check_payload_size(message_dict)
+        if idempotency_key is None:
+            content = dict((k, v) for k, v in message_dict.items() if k not in ('token', 'topic', 'condition'))
+            idempotency_key = hashlib.blake2b(json.dumps(content, sort_keys=True).encode('utf-8'),
+                                              digest_size=16).hexdigest()
+        app = push_admin.get_app(app_id).appid_push
+        fresh, keys = [], []
+        for kind, target in self._targets(message_dict):
+            key = '\x00'.join((app, kind, str(target), str(idempotency_key))).encode('utf-8')
+            if key not in self.filter:
+                fresh.append(target)
+                keys.append(key)
+        targets = len(message_dict.get('token') or ()) or 1
+        with self._lock:
+            self.suppressed += targets - len(fresh)
+            self.passed += len(fresh)
+        if targets > len(fresh):
+            SUPPRESSED.labels(app).inc(targets - len(fresh))
+        if not fresh:
+            return None, keys, fresh
+        if message_dict.get('token'):
+            message_dict['token'] = fresh
+        return json.dumps({'validate_only': validate_only, 'message': message_dict}), keys, fresh
+
+    def _remember(self, response, keys, fresh, validate_only):
+        if validate_only:
+            return
+        code = str(response.code)
+        if code == _app.App.SUCCESS_CODE:
+            accepted = keys
+        elif code == _PARTIAL_SUCCESS_CODE:
+            illegal = _illegal_tokens({'msg': response.reason}) or set()
+            accepted = [key for key, target in zip(keys, fresh) if target not in illegal]
+        else:
+            return
+        for key in accepted:
+            self.filter.add(key)
+
+    @staticmethod
+    def _suppressed_response():
+        return messaging.SendResponse({'code': _app.App.SUCCESS_CODE, 'msg': SUPPRESSED_MSG, 'requestId': None})
+
+    def send(self, message, validate_only=False, app_id=None, verify_peer=False, idempotency_key=None):
+        """
+        :param message: An instance of ``messaging.Message``
+        :param idempotency_key: (optional) caller's key of the notification, default a hash of its content
+        :return: SendResponse of the fresh tokens, or a suppressed response
+        """
+        body, keys, fresh = self._prepare(message, validate_only, app_id, idempotency_key)
+        if body is None:
+            return self._suppressed_response()
+        response = messaging.send_serialized(body, app_id=app_id, verify_peer=verify_peer)
+        self._remember(response, keys, fresh, validate_only)
+        return response
+
+    def submit(self, sender, message, validate_only=False, idempotency_key=None):
+        """
+        :param sender: the ``messaging.Sender`` sending the fresh tokens
+        :return: concurrent.futures.Future of the SendResponse
+        """
+        body, keys, fresh = self._prepare(message, validate_only, sender.app_id, idempotency_key)
+        if body is None:
+            future = concurrent.futures.Future()
+            future.set_result(self._suppressed_response())
+            return future
+        future = sender.submit_serialized(body, priority=_deadline.message_priority(message),
+                                          ttl=_deadline.message_ttl(message))
+
+        def remember(done):
+            if not done.cancelled() and done.exception() is None:
+                self._remember(done.result(), keys, fresh, validate_only)
+        future.add_done_callback(remember)
+        return future
+
+    def stats(self):
+        """
+        :return: dict with suppressed and passed token sends, early rotations, slices dropped inside
+            the window and filter memory in bytes
+        """
+        return {'suppressed': self.suppressed, 'passed': self.passed,
+                'early_rotations': self.filter.early_rotations, 'window_shortened': self.filter.window_shortened,
+                'memory_bytes': self.filter.size}
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Multi-process dispatch of pre-serialized request bodies.
+
+The parent process packs the bodies into a shared memory segment and hands the worker
+processes (offset, length) ranges, so no Message objects are pickled. While a segment is
+sent the parent keeps the app's access token fresh and republishes it in a small shared
+memory block, which the workers read before every request. Requires Python 3.8 or later
+for multiprocessing.shared_memory.
+"""
+
+import concurrent.futures
+import struct
+import time
+
+from src.push_admin import _app
+
+# sequence, odd while the token is rewritten, token expiry in ms and token length
+_TOKEN_HEADER = struct.Struct('<QqI')
+_TOKEN_SEQUENCE = struct.Struct('<Q')
+_TOKEN_BLOCK_SIZE = 8192
+# seconds between the token checks of the parent while a segment is sent
+_TOKEN_CHECK_INTERVAL = 1.0
+
+# state of a worker process, set by _init_worker
+_worker = None
+
+
+class _WorkerState(object):
+    def __init__(self, appid, appid_push, push_open_url, token_block_name, verify_peer):
+        from multiprocessing import shared_memory
+        self.shared_memory = shared_memory
+        self.app = _app.App(appid, None, appid_push, push_open_url=push_open_url)
+        self.url = self.app.hw_push_server.format(self.app.appid_push)
+        self.token_block = _attach(shared_memory, token_block_name)
+        self.verify_peer = verify_peer
+        self.segment = None
+        self._sequence = None
+        self._headers = None
+
+    def segment_buffer(self, name):
+        if self.segment is None or self.segment.name != name:
+            if self.segment is not None:
+                self.segment.close()
+            self.segment = _attach(self.shared_memory, name)
+        return self.segment.buf
+
+    def headers(self):
+        """request headers with the token last published by the parent"""
+        buf = self.token_block.buf
+        while True:
+            sequence, _, length = _TOKEN_HEADER.unpack_from(buf, 0)
+            if sequence == self._sequence:
+                return self._headers
+            if sequence % 2:
+                # the parent is rewriting the token
+                time.sleep(0)
+                continue
+            token = bytes(buf[_TOKEN_HEADER.size:_TOKEN_HEADER.size + length])
+            if _TOKEN_SEQUENCE.unpack_from(buf, 0)[0] != sequence:
+                continue
+            self._sequence = sequence
+            self._headers = {'Content-Type': 'application/json;charset=utf-8',
+                             'Authorization': 'Bearer {0}'.format(token.decode('utf-8'))}
+            return self._headers
+
+
+def _attach(shared_memory, name):
+    # workers are children of the dispatcher and share its resource tracker, so attaching
+    # does not make them owners; the dispatcher unlinks every segment it creates
+    return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(appid, appid_push, push_open_url, token_block_name, verify_peer):
+    global _worker
+    _worker = _WorkerState(appid, appid_push, push_open_url, token_block_name, verify_peer)
+
+
+def _error_code(error):
+    """'http_<status>' of a rejected request, else the name of the exception that failed it"""
+    while isinstance(error, _app.ApiCallError) and error.detail is not None:
+        error = error.detail
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return 'http_{0}'.format(status)
+    return type(error).__name__
+
+
+def _send_chunk(segment_name, entries):
+    """send the bodies at the given (index, offset, length) ranges, return (index, code, requestId, latency)"""
+    buf = _worker.segment_buffer(segment_name)
+    results = []
+    for index, offset, length in entries:
+        body = bytes(buf[offset:offset + length]).decode('utf-8')
+        begin = time.perf_counter()
+        try:
+            response = _worker.app._send_to_server(_worker.headers(), body, _worker.url, _worker.verify_peer)
+            code, request_id = str(response.get('code')), response.get('requestId')
+        except Exception as e:
+            code, request_id = _error_code(e), None
+        results.append((index, code, request_id, time.perf_counter() - begin))
+    return results
+
+
+class ProcessDispatcher(object):
+    """
+    Send pre-serialized request bodies from a pool of worker processes.
+
+        with ProcessDispatcher(push_admin.get_app(), processes=8) as dispatcher:
+            results = dispatcher.dispatch(template.render_batch(batch))
+
+    Each result is a (code, requestId, latency in seconds) tuple, code is the HCM result
+    code, 'http_<status>' for a rejected request or the name of the exception that failed it.
+    The bodies are sent as is, their payload size is not checked:
+    render them with MessageTemplate, which checks it, or check it when building them.
+    """
+    def __init__(self, app, processes=None, segment_size=64 * 1024 * 1024, chunk_size=256, verify_peer=False):
+        """
+        :param app: the App whose token and push URL are used
+        :param processes: number of worker processes, default the number of CPUs
+        :param segment_size: bytes of request bodies packed into one shared memory segment
+        :param chunk_size: bodies handed to a worker per task
+        :param verify_peer: HTTPS server identity verification
+        """
+        from multiprocessing import shared_memory
+        self._shared_memory = shared_memory
+        self.app = app
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.verify_peer = verify_peer
+        self._token_block = shared_memory.SharedMemory(create=True, size=_TOKEN_BLOCK_SIZE)
+        self._token_sequence = 0
+        self._published_token = None
+        self._publish_token()
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker,
+            initargs=(app.app_id_at, app.appid_push, app.push_open_url, self._token_block.name, verify_peer))
+
+    def _publish_token(self):
+        self.app._update_token(self.verify_peer)
+        token = self.app.access_token
+        if token == self._published_token:
+            return
+        data = token.encode('utf-8')
+        if _TOKEN_HEADER.size + len(data) > _TOKEN_BLOCK_SIZE:
+            raise ValueError('Access token does not fit in the shared token block.')
+        # odd sequence while rewriting, workers reading meanwhile retry
+        buf = self._token_block.buf
+        _TOKEN_SEQUENCE.pack_into(buf, 0, self._token_sequence + 1)
+        buf[_TOKEN_HEADER.size:_TOKEN_HEADER.size + len(data)] = data
+        self._token_sequence += 2
+        _TOKEN_HEADER.pack_into(buf, 0, self._token_sequence, self.app.token_expired_time, len(data))
+        self._published_token = token
+
+    def dispatch(self, bodies):
+        """
+        :param bodies: iterable of serialized request bodies, str or bytes
+        :return: list of (code, requestId, latency) in the order of the bodies
+        """
+        results = []
+        segment_bodies = []
+        segment_bytes = 0
+        for body in bodies:
+            data = body.encode('utf-8') if isinstance(body, str) else body
+            if len(data) > self.segment_size:
+                raise ValueError('Request body of {0} bytes exceeds the segment size.'.format(len(data)))
+            if segment_bytes + len(data) > self.segment_size:
+                results.extend(self._dispatch_segment(segment_bodies, segment_bytes))
+                segment_bodies = []
+                segment_bytes = 0
+            segment_bodies.append(data)
+            segment_bytes += len(data)
+        if segment_bodies:
+            results.extend(self._dispatch_segment(segment_bodies, segment_bytes))
+        return results
+
+    def _dispatch_segment(self, bodies, size):
+        self._publish_token()
+        segment = self._shared_memory.SharedMemory(create=True, size=max(1, size))
+        try:
+            entries = []
+            offset = 0
+            for index, data in enumerate(bodies):
+                segment.buf[offset:offset + len(data)] = data
+                entries.append((index, offset, len(data)))
+                offset += len(data)
+
+            futures = [self._executor.submit(_send_chunk, segment.name, entries[i:i + self.chunk_size])
+                       for i in range(0, len(entries), self.chunk_size)]
+            pending = set(futures)
+            try:
+                while pending:
+                    # refresh the token before it expires in the middle of a long segment
+                    _, pending = concurrent.futures.wait(pending, timeout=_TOKEN_CHECK_INTERVAL)
+                    self._publish_token()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+            results = [None] * len(bodies)
+            for future in futures:
+                for index, code, request_id, latency in future.result():
+                    results[index] = (code, request_id, latency)
+            return results
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._token_block.close()
+        self._token_block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -14,10 +14,72 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import requests
+import threading
 
+from src.push_admin import _tracing
 
-def post(url, req_body, headers=None, verify_peer=False):
+# requests.adapters.DEFAULT_POOLSIZE; requests itself takes longer to import than the rest of
+# the SDK, so it is imported on the first network call rather than with the package
+DEFAULT_POOLSIZE = 10
+
+
+def _requests():
+    import requests
+    return requests
+
+
+def create_session(pool_size=DEFAULT_POOLSIZE):
+    """ create a session holding a pool of keep-alive connections
+        :param pool_size: connections kept per host, raise it to the number of sending threads
+    """
+    session = _requests().Session()
+    if pool_size != DEFAULT_POOLSIZE:
+        mount_pool(session, pool_size)
+    return session
+
+
+def mount_pool(session, pool_size):
+    """ replace the connection pools of a session, connections of the previous pools are dropped """
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def open_connections(session, url, count, verify_peer=False, timeout=10):
+    """ open count keep-alive connections to the host of url and leave them in the session's pool
+        :param count: number of connections, at most the pool size of the session
+        :return: number of connections opened and kept alive by the host
+    """
+    if count <= 0:
+        return 0
+    barrier = threading.Barrier(count)
+    opened = []
+
+    def connect():
+        try:
+            # start together so that no request gets a connection another one returned
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass
+        try:
+            # any status will do, the connection stays pooled once the response is read unless
+            # the host closes it, e.g. with a 501 for a method it does not serve
+            response = session.head(url, timeout=timeout, verify=verify_peer, allow_redirects=False)
+            if response.headers.get('Connection', '').lower() != 'close':
+                opened.append(True)
+        except Exception:
+            pass
+
+    threads = [threading.Thread(target=connect, name='hcm-connect', daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(opened)
+
+
+def post(url, req_body, headers=None, verify_peer=False, session=None):
     """ post http request to slb service
         :param url: url path
         :param req_body: http request body
@@ -25,13 +87,17 @@ def post(url, req_body, headers=None, verify_peer=False):
         :param verify_peer:  (optional) Either a boolean, in which case it controls whether we verify
             the server's TLS certificate, or a string, in which case it must be a path
             to a CA bundle to use. Defaults to ``True``.
+        :param session: (optional) a session from ``create_session``, its pooled connections are reused
         :return:
             success return response
             fali return None
     """
     try:
-        response = requests.post(url, data=req_body, headers=headers, timeout=10, verify=verify_peer)
-        return response
+        with _tracing.start_span('hcm.http.post', url=url) as span:
+            sender = _requests() if session is None else session
+            response = sender.post(url, data=req_body, headers=headers, timeout=10, verify=verify_peer)
+            span.set_attribute('http_status', response.status_code)
+            return response
 
     except Exception as e:
         raise ValueError('caught exception when post {0}. {1}'.format(url, e))
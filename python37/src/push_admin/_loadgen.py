@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load generator for campaign scale sends.
+
+    python -m src.push_admin loadgen --template message.json --tokens tokens.txt \\
+        --rate 2000 --concurrency 32 --mode threads --duration 60
+
+The template is a message as produced by MessageSerializer.default, its token list is
+replaced by tokens from the token source. Requests go through App.send_serialized, by
+default against the local stub (python -m benchmark.stub_server).
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from json.encoder import encode_basestring_ascii
+
+from src.push_admin import _app
+
+_DEFAULT_URL = 'http://127.0.0.1:8080'
+_TOKEN_MARK = '__hcm_loadgen_tokens__'
+
+
+class LoadConfig(object):
+    """settings of a load run, must stay picklable for the processes mode"""
+    def __init__(self, template, tokens, tokens_per_request=1, rate=0.0, concurrency=8, mode='threads',
+                 duration=None, count=None, appid='loadgen', app_secret='loadgen', push_open_url=_DEFAULT_URL,
+                 token_server=None, validate_only=False, verify_peer=False):
+        self.template = template
+        self.tokens = tokens
+        self.tokens_per_request = tokens_per_request
+        self.rate = rate
+        self.concurrency = concurrency
+        self.mode = mode
+        self.duration = duration
+        self.count = count
+        self.appid = appid
+        self.app_secret = app_secret
+        self.push_open_url = push_open_url
+        self.token_server = token_server or push_open_url + '/oauth2/v3/token'
+        self.validate_only = validate_only
+        self.verify_peer = verify_peer
+
+
+class _BodyFactory(object):
+    """serialize the template once, then splice token chunks into it"""
+    def __init__(self, config):
+        message = dict(config.template)
+        _app.App.JSON_ENCODER.check_payload_size(message)
+        message.pop('topic', None)
+        message.pop('condition', None)
+        message['token'] = [_TOKEN_MARK]
+        text = json.dumps({'validate_only': config.validate_only, 'message': message})
+        self._prefix, self._suffix = text.split(encode_basestring_ascii(_TOKEN_MARK))
+        size = max(1, config.tokens_per_request)
+        tokens = config.tokens
+        self._chunks = [', '.join(encode_basestring_ascii(token) for token in tokens[i:i + size])
+                        for i in range(0, len(tokens), size)]
+
+    def body(self, index):
+        return self._prefix + self._chunks[index % len(self._chunks)] + self._suffix
+
+
+class _Pacer(object):
+    """hand out request indexes, spaced by the target rate and bounded by count and duration"""
+    def __init__(self, config, start, offset=0, stride=1):
+        self._interval = 1.0 / config.rate if config.rate else 0.0
+        self._count = config.count
+        self._deadline = start + config.duration if config.duration else None
+        self._start = start
+        self._indexes = itertools.count(offset, stride)
+        self._lock = threading.Lock()
+        self.stopped = False
+
+    def next(self):
+        """:return: the next request index, or None when the run is over"""
+        with self._lock:
+            index = next(self._indexes)
+        if self.stopped or (self._count is not None and index >= self._count):
+            return None
+        due = self._start + index * self._interval
+        if self._deadline is not None and max(due, time.monotonic()) >= self._deadline:
+            return None
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return index
+
+
+class _Stats(object):
+    """latencies and result codes, totals and per reporting interval"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codes = collections.Counter()
+        self.latencies = []
+        self.interval = []
+
+    def add(self, records):
+        with self.lock:
+            for latency, code in records:
+                self.codes[code] += 1
+                self.latencies.append(latency)
+                self.interval.append(latency)
+
+    def take_interval(self):
+        with self.lock:
+            interval, self.interval = self.interval, []
+        return interval
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100.0 * len(sorted_values)))]
+
+
+def _send_one(app, factory, index, verify_peer):
+    begin = time.perf_counter()
+    try:
+        code = str(app.send_serialized(factory.body(index), verify_peer=verify_peer).get('code'))
+    except Exception:
+        code = 'exception'
+    return time.perf_counter() - begin, code
+
+
+def _build_app(config):
+    return _app.App(config.appid, config.app_secret, None, token_server=config.token_server,
+                    push_open_url=config.push_open_url)
+
+
+def _run_threads(config, stats, pacer):
+    app = _build_app(config)
+    factory = _BodyFactory(config)
+
+    def worker():
+        while True:
+            index = pacer.next()
+            if index is None:
+                return
+            stats.add([_send_one(app, factory, index, config.verify_peer)])
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(config.concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+def _run_asyncio(config, stats, pacer):
+    app = _build_app(config)
+    factory = _BodyFactory(config)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(config.concurrency)
+        executor = concurrent.futures.ThreadPoolExecutor(config.concurrency)
+
+        async def send(index):
+            try:
+                record = await loop.run_in_executor(executor, _send_one, app, factory, index, config.verify_peer)
+                stats.add([record])
+            finally:
+                semaphore.release()
+
+        tasks = set()
+        while True:
+            await semaphore.acquire()
+            # the pacer sleeps until the request is due, keep that off the event loop
+            index = await loop.run_in_executor(None, pacer.next)
+            if index is None:
+                semaphore.release()
+                break
+            task = loop.create_task(send(index))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def _process_main(config, start_wall, offset, stride, results):
+    # monotonic clocks are not shared between processes, rebase the start on the wall clock
+    start = time.monotonic() - (time.time() - start_wall)
+    pacer = _Pacer(config, start, offset, stride)
+    app = _build_app(config)
+    factory = _BodyFactory(config)
+    batch = []
+    flushed = time.monotonic()
+    while True:
+        index = pacer.next()
+        if index is None:
+            break
+        batch.append(_send_one(app, factory, index, config.verify_peer))
+        if len(batch) >= 100 or time.monotonic() - flushed >= 0.5:
+            results.put(batch)
+            batch = []
+            flushed = time.monotonic()
+    results.put(batch)
+    results.put(None)
+
+
+def _run_processes(config, stats, pacer):
+    results = multiprocessing.Queue()
+    start_wall = time.time() - (time.monotonic() - pacer._start)
+    workers = [multiprocessing.Process(target=_process_main, args=(config, start_wall, offset,
+                                                                   config.concurrency, results), daemon=True)
+               for offset in range(config.concurrency)]
+    for process in workers:
+        process.start()
+    running = len(workers)
+    while running:
+        try:
+            batch = results.get(timeout=0.5)
+        except queue.Empty:
+            if not any(process.is_alive() for process in workers):
+                break
+            continue
+        if batch is None:
+            running -= 1
+        else:
+            stats.add(batch)
+    for process in workers:
+        process.join()
+
+
+_RUNNERS = {'threads': _run_threads, 'asyncio': _run_asyncio, 'processes': _run_processes}
+
+
+def run(config, report_interval=1.0, out=print):
+    """
+    Drive the load and print live throughput and latency percentiles.
+    :param config: LoadConfig
+    :param report_interval: seconds between progress lines
+    :param out: callable receiving the report lines
+    :return: dict summary with requests, elapsed, rate, p50_ms, p99_ms and codes
+    """
+    if not config.tokens:
+        raise ValueError('LoadConfig.tokens must not be empty.')
+    if config.mode not in _RUNNERS:
+        raise ValueError('LoadConfig.mode must be one of {0}.'.format(sorted(_RUNNERS)))
+    if config.count is None and config.duration is None:
+        raise ValueError('LoadConfig needs a count or a duration.')
+
+    stats = _Stats()
+    start = time.monotonic()
+    pacer = _Pacer(config, start)
+    runner = threading.Thread(target=_RUNNERS[config.mode], args=(config, stats, pacer), daemon=True)
+    runner.start()
+    last = start
+    try:
+        while runner.is_alive():
+            runner.join(report_interval)
+            now = time.monotonic()
+            interval = sorted(stats.take_interval())
+            with stats.lock:
+                sent = len(stats.latencies)
+                errors = sent - stats.codes.get(_app.App.SUCCESS_CODE, 0)
+            out('[{0:7.1f}s] sent={1} errors={2} rate={3:,.1f}/s p50={4:.2f}ms p99={5:.2f}ms'.format(
+                now - start, sent, errors, len(interval) / max(now - last, 1e-9),
+                _percentile(interval, 50) * 1000, _percentile(interval, 99) * 1000))
+            last = now
+    except KeyboardInterrupt:
+        pacer.stopped = True
+        runner.join()
+
+    elapsed = time.monotonic() - start
+    latencies = sorted(stats.latencies)
+    summary = {
+        'requests': len(latencies),
+        'elapsed': elapsed,
+        'rate': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'codes': dict(stats.codes),
+    }
+    out('total: {0} requests in {1:.1f}s, {2:,.1f}/s, p50={3:.2f}ms p99={4:.2f}ms, codes={5}'.format(
+        summary['requests'], elapsed, summary['rate'], summary['p50_ms'], summary['p99_ms'], summary['codes']))
+    return summary
+
+
+def _load_tokens(args):
+    if args.tokens:
+        with open(args.tokens) as f:
+            return [line.strip() for line in f if line.strip()]
+    return ['loadgen-token-{0:08d}'.format(i) for i in range(args.synthetic_tokens)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.push_admin loadgen',
+                                     description='Drive HCM sends at a target rate and report throughput.')
+    parser.add_argument('--template', required=True,
+                        help='JSON file with a message as serialized by MessageSerializer')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--tokens', help='file with one token per line')
+    source.add_argument('--synthetic-tokens', type=int, default=10000, help='number of generated tokens')
+    parser.add_argument('--tokens-per-request', type=int, default=1, help='tokens per request, at most 1000')
+    parser.add_argument('--rate', type=float, default=0.0, help='target requests per second, 0 for unbounded')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads, processes or in-flight requests')
+    parser.add_argument('--mode', choices=sorted(_RUNNERS), default='threads')
+    parser.add_argument('--duration', type=float, help='seconds to run')
+    parser.add_argument('--count', type=int, help='number of requests to send')
+    parser.add_argument('--push-open-url', default=_DEFAULT_URL, help='push endpoint, default the local stub')
+    parser.add_argument('--token-server', help='OAuth endpoint, default <push-open-url>/oauth2/v3/token')
+    parser.add_argument('--app-id', default='loadgen')
+    parser.add_argument('--app-secret', default='loadgen')
+    parser.add_argument('--validate-only', action='store_true')
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.tokens_per_request <= 1000:
+        parser.error('--tokens-per-request must be within 1 to 1000')
+    if args.count is None and args.duration is None:
+        args.duration = 10.0
+    with open(args.template) as f:
+        template = json.load(f)
+
+    config = LoadConfig(template, _load_tokens(args), tokens_per_request=args.tokens_per_request, rate=args.rate,
+                        concurrency=args.concurrency, mode=args.mode, duration=args.duration, count=args.count,
+                        appid=args.app_id, app_secret=args.app_secret, push_open_url=args.push_open_url,
+                        token_server=args.token_server, validate_only=args.validate_only)
+    run(config)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-locale variants of a message rendered on the server.
+
+The base message is serialized once; each locale variant is a copy of the serialized
+dict with the locale's strings applied, encoded once into the request body around a
+token placeholder and kept in a bounded LRU cache. Sending a chunk of tokens then only
+splices the tokens into the cached body.
+"""
+
+import collections
+import copy
+import json
+import threading
+from json.encoder import encode_basestring_ascii
+
+from src.push_admin import _app
+from src.push_admin import _batch_result
+from src.push_admin import _deadline
+
+_ENCODER = _app.App.JSON_ENCODER
+_TOKEN_MARK = '__hcm_locale_tokens__'
+
+# containers of the serialized message the 'title' and 'body' strings apply to
+TEXT_PATHS = (('notification',), ('android', 'notification'), ('apns', 'payload', 'aps', 'alert'),
+              ('webpush', 'notification'))
+
+
+def _apply(message_dict, strings):
+    """
+    apply a locale's strings to a serialized message dict, in place
+    Raise: ValueError if a dotted key leads through a value that is not an object
+    """
+    for key, value in strings.items():
+        if key in ('title', 'body'):
+            for path in TEXT_PATHS:
+                container = message_dict
+                for name in path:
+                    container = container.get(name) if isinstance(container, dict) else None
+                if isinstance(container, dict):
+                    container[key] = value
+                elif container is not None and path[-1] == 'alert' and key == 'body':
+                    # an APNs alert given as a plain string
+                    message_dict['apns']['payload']['aps']['alert'] = value
+            continue
+        names = key.split('.')
+        container = message_dict
+        for name in names[:-1]:
+            container = container.setdefault(name, dict())
+            if not isinstance(container, dict):
+                raise ValueError('Localized string key {0} leads through {1}, which is not an object.'.format(
+                    key, name))
+        if value is None:
+            container.pop(names[-1], None)
+        else:
+            container[names[-1]] = value
+
+
+class LocalizedMessage(object):
+    """
+    A message with server rendered strings per locale:
+
+        localized = messaging.LocalizedMessage(message, {
+            'en': {'title': 'Sale', 'body': 'Half price today'},
+            'de': {'title': 'Angebot', 'body': 'Heute zum halben Preis'},
+            'fr': {'title': 'Soldes', 'body': 'Moitié prix', 'android.notification.title_loc_key': None},
+        }, fallback='en')
+        result = localized.send(sender, [(token, locale) for token, locale in audience])
+        result.wait()
+
+    The strings of a locale map 'title' and 'body' to the notification, Android
+    notification, APNs alert and web push notification present in the message; other
+    keys are dotted paths in the serialized message, e.g. 'android.notification.image',
+    a value of None removes the field, e.g. a loc key superseded by the rendered text.
+    A locale like 'pt-BR' falls back to 'pt', then to fallback, then to the message as is.
+    """
+    def __init__(self, message, strings, fallback=None, validate_only=False, max_variants=256):
+        """
+        :param message: An instance of ``messaging.Message``, its target is ignored
+        :param strings: dict of locale -> dict of key -> localized value
+        :param fallback: (optional) locale used for the locales without strings
+        :param validate_only: dry run mode
+        :param max_variants: maximum number of serialized variants cached
+        Raise: ValueError if a locale's strings do not apply to the message
+        """
+        if max_variants < 1:
+            raise ValueError('LocalizedMessage max_variants must be positive.')
+        self.strings = dict((self._normalize(locale), value) for locale, value in strings.items())
+        self.fallback = self._normalize(fallback) if fallback is not None else None
+        if self.fallback is not None and self.fallback not in self.strings:
+            raise ValueError('LocalizedMessage fallback {0} has no strings.'.format(fallback))
+        self.validate_only = validate_only
+        self.max_variants = max_variants
+        self.priority = _deadline.message_priority(message)
+        self.ttl = _deadline.message_ttl(message)
+        message_dict = _ENCODER.default(message)
+        for field in _ENCODER.TARGET_FIELDS:
+            message_dict.pop(field, None)
+        for locale, locale_strings in self.strings.items():
+            try:
+                _apply(copy.deepcopy(message_dict), locale_strings)
+            except ValueError as e:
+                raise ValueError('LocalizedMessage strings of {0}: {1}'.format(locale, e))
+        self._base = message_dict
+        self._variants = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(locale):
+        return locale.replace('_', '-').lower()
+
+    def resolve(self, locale):
+        """:return: the locale whose strings a user of locale gets, None for the message as is"""
+        if locale is not None:
+            locale = self._normalize(locale)
+            if locale in self.strings:
+                return locale
+            language = locale.split('-')[0]
+            if language in self.strings:
+                return language
+        return self.fallback
+
+    def variant(self, locale):
+        """
+        :param locale: a locale as resolved by ``resolve``, or None
+        :return: (prefix, suffix) of the request body around the token list
+        Raise: ValueError if the localized payload is too large
+        """
+        with self._lock:
+            cached = self._variants.get(locale)
+            if cached is not None:
+                self._variants.move_to_end(locale)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        message_dict = copy.deepcopy(self._base)
+        if locale is not None:
+            _apply(message_dict, self.strings[locale])
+        _ENCODER.check_payload_size(message_dict)
+        message_dict['token'] = [_TOKEN_MARK]
+        body = json.dumps({'validate_only': self.validate_only, 'message': message_dict})
+        prefix, suffix = body.split(encode_basestring_ascii(_TOKEN_MARK))
+        with self._lock:
+            self._variants[locale] = (prefix, suffix)
+            while len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        return prefix, suffix
+
+    def body(self, locale, tokens):
+        """:return: JSON text of the request sending the locale's variant to tokens"""
+        prefix, suffix = self.variant(self.resolve(locale))
+        return prefix + ', '.join(encode_basestring_ascii(token) for token in tokens) + suffix
+
+    def group(self, audience):
+        """
+        :param audience: iterable of (token, locale) pairs, or dict of locale -> tokens
+        :return: dict of resolved locale -> token list
+        """
+        if isinstance(audience, dict):
+            pairs = ((token, locale) for locale, tokens in audience.items() for token in tokens)
+        else:
+            pairs = audience
+        groups = collections.defaultdict(list)
+        resolved = dict()
+        for token, locale in pairs:
+            key = resolved.get(locale, resolved)
+            if key is resolved:
+                key = resolved[locale] = self.resolve(locale)
+            groups[key].append(token)
+        return dict(groups)
+
+    def send(self, sender, audience, max_tokens=None, result=None):
+        """
+        Send each locale group of the audience with its variant, in requests of up to max_tokens tokens.
+        :param sender: the ``messaging.Sender`` sending the requests
+        :param audience: iterable of (token, locale) pairs, or dict of locale -> tokens
+        :param max_tokens: (optional) maximum number of tokens per request, at most 1000
+        :param result: (optional) ``messaging.BatchResult`` the requests are tracked in
+        :return: the BatchResult, call its wait() for the pending requests
+        """
+        if max_tokens is None:
+            max_tokens = _ENCODER.MAX_TOKENS
+        if not 1 <= max_tokens <= _ENCODER.MAX_TOKENS:
+            raise ValueError('LocalizedMessage max_tokens must be within 1 to {0}.'.format(_ENCODER.MAX_TOKENS))
+        if result is None:
+            result = _batch_result.BatchResult()
+        chunk = 0
+        for locale, tokens in self.group(audience).items():
+            prefix, suffix = self.variant(locale)
+            for i in range(0, len(tokens), max_tokens):
+                part = tokens[i:i + max_tokens]
+                body = prefix + ', '.join(encode_basestring_ascii(token) for token in part) + suffix
+                result.track(sender.submit_serialized(body, priority=self.priority, ttl=self.ttl), chunk, len(part))
+                chunk += 1
+        return result
+
+    def stats(self):
+        """
+        :return: dict with cached variants, cache hits and misses
+        """
+        return {'variants': len(self._variants), 'hits': self.hits, 'misses': self.misses}
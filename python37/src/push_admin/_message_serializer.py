@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import json
+from json.encoder import encode_basestring_ascii
 from src.push_admin import _messages
 import six
 
@@ -36,6 +37,12 @@ class MessageSerializer(json.JSONEncoder):
     _messages.AndroidClickAction
     _messages.BadgeNotification
     """
+    # maximum encoded size of a message payload, i.e. the message without token, topic or condition
+    MAX_PAYLOAD_SIZE = 4096
+    # maximum number of tokens in one request
+    MAX_TOKENS = 1000
+    TARGET_FIELDS = ('token', 'topic', 'condition')
+
     def default(self, message):
         """
         :param message: The push message
@@ -58,6 +65,102 @@ class MessageSerializer(json.JSONEncoder):
     def remove_null_values(cls, dict_value):
         return {k: v for k, v in dict_value.items() if v not in [None, [], {}]}
 
+    @classmethod
+    def encoded_size(cls, value):
+        """
+        Compute the size in bytes of json.dumps(value) without building the JSON text.
+        :param value: a serialized message dict, or any part of it
+        :return: encoded size in bytes
+        """
+        if isinstance(value, six.string_types):
+            return len(encode_basestring_ascii(value))
+        if value is None or value is True:
+            return 4
+        if value is False:
+            return 5
+        if isinstance(value, six.integer_types):
+            return len(int.__repr__(value))
+        if isinstance(value, dict):
+            if not value:
+                return 2
+            # '{' + '"key": value' entries joined by ', ' + '}'
+            size = 2 * len(value)
+            for key, item in value.items():
+                if not isinstance(key, six.string_types):
+                    key = json.dumps(key).strip('"')
+                size += len(encode_basestring_ascii(key)) + 2 + cls.encoded_size(item)
+            return size
+        if isinstance(value, (list, tuple)):
+            if not value:
+                return 2
+            size = 2 * len(value)
+            for item in value:
+                size += cls.encoded_size(item)
+            return size
+        return len(json.dumps(value))
+
+    @classmethod
+    def payload_size(cls, message_dict):
+        """
+        :param message_dict: a message serialized by ``MessageSerializer.default``
+        :return: encoded size of the message without its token, topic and condition
+        """
+        return cls.encoded_size({k: v for k, v in message_dict.items() if k not in cls.TARGET_FIELDS})
+
+    @classmethod
+    def check_payload_size(cls, message_dict, max_payload_size=None):
+        """
+        Reject an oversized message before it is sent.
+        :param message_dict: a message serialized by ``MessageSerializer.default``
+        :param max_payload_size: (optional) limit in bytes, default ``MAX_PAYLOAD_SIZE``
+        :return: the payload size
+        Raise: ValueError
+        """
+        if max_payload_size is None:
+            max_payload_size = cls.MAX_PAYLOAD_SIZE
+        size = cls.payload_size(message_dict)
+        if size > max_payload_size:
+            raise ValueError('Message payload is {0} bytes, it must not exceed {1} bytes.'.format(
+                size, max_payload_size))
+        return size
+
+    @classmethod
+    def split_tokens(cls, message_dict, tokens, max_body_size, max_tokens=None, validate_only=False):
+        """
+        Split a token audience into chunks so that the request body of each chunk stays
+        within ``max_body_size`` bytes and ``max_tokens`` tokens.
+        :param message_dict: a message serialized by ``MessageSerializer.default``, its token is ignored
+        :param tokens: iterable of tokens
+        :param max_body_size: maximum encoded size of a request body in bytes
+        :param max_tokens: (optional) maximum number of tokens per request, default ``MAX_TOKENS``
+        :param validate_only: validate message format or not
+        :return: generator of token lists
+        Raise: ValueError if a single token does not fit
+        """
+        if max_tokens is None:
+            max_tokens = cls.MAX_TOKENS
+        body = {'validate_only': validate_only,
+                'message': dict(message_dict, token=[])}
+        base_size = cls.encoded_size(body)
+
+        chunk = []
+        size = base_size
+        for token in tokens:
+            token_size = len(encode_basestring_ascii(token))
+            added = token_size + 2 if chunk else token_size
+            if chunk and (size + added > max_body_size or len(chunk) >= max_tokens):
+                yield chunk
+                chunk = []
+                size = base_size
+                added = token_size
+            if size + added > max_body_size:
+                raise ValueError('Request body is {0} bytes with a single token, it must not exceed {1} bytes.'
+                                 .format(size + added, max_body_size))
+            chunk.append(token)
+            size += added
+        if chunk:
+            yield chunk
+
     @classmethod
     def encode_notification(cls, notification):
         """
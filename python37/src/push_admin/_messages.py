@@ -18,6 +18,8 @@ import numbers
 import re
 import six
 
+from src.push_admin import _condition
+
 
 class Message(object):
     """A message that can be sent Huawei Cloud Messaging.
@@ -650,7 +652,14 @@ class MessageValidator(object):
                 raise ValueError('token must not contain more than 1000 tokens')
 
         cls.check_string(hint="Message.topic", value=topic)
+        cls.check_condition(condition)
+
+    @classmethod
+    def check_condition(cls, condition):
+        """Checks the syntax and the operand limits of a condition expression."""
         cls.check_string(hint="Message.condition", value=condition)
+        if condition is not None:
+            _condition.compile_condition(condition)
 
     @classmethod
     def check_notification(cls, title, body, image):
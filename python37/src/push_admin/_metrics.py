@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Dependency free counters and latency histograms for the SDK.
+
+Metric families are created once with their label names, and a child per label
+value tuple is cached, e.g.:
+
+    REQUEST_SECONDS.labels(appid, 'send', 'network').observe(0.012)
+
+Listeners added with ``MetricsRegistry.add_listener`` see every observation and can
+forward it to any other monitoring system. ``prometheus_text`` renders the Prometheus
+text exposition format and ``PrometheusCollector`` exposes the metrics through the
+optional ``prometheus_client`` package.
+"""
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    """a monotonically increasing value"""
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """observations counted in cumulative upper bound buckets"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, q):
+        """
+        Estimate a percentile by linear interpolation inside the bucket holding it.
+        :param q: percentile within [0, 100]
+        :return: estimated value, or None without observations
+        """
+        with self._lock:
+            counts = list(self.bucket_counts)
+            total = self.count
+        if total == 0:
+            return None
+        rank = q / 100.0 * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricFamily(object):
+    """a named metric with one child per combination of label values"""
+    def __init__(self, registry, name, kind, documentation, label_names, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError('Metric {0} expects labels {1}.'.format(self.name, self.label_names))
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = Counter() if self.kind == 'counter' else Histogram(self.buckets or DEFAULT_BUCKETS)
+                    child = _Child(self, values, child)
+                    self._children[values] = child
+        return child
+
+    def remove_matching(self, label_name, value):
+        """drop the children whose label_name is value, e.g. the series of a removed app"""
+        if label_name not in self.label_names:
+            return
+        index = self.label_names.index(label_name)
+        with self._lock:
+            self._children = dict((values, child) for values, child in self._children.items()
+                                  if values[index] != value)
+
+    def children(self):
+        """list of (label values, Counter or Histogram)"""
+        with self._lock:
+            return [(values, child.metric) for values, child in self._children.items()]
+
+
+class _Child(object):
+    def __init__(self, family, values, metric):
+        self.family = family
+        self.values = values
+        self.metric = metric
+
+    def inc(self, amount=1):
+        registry = self.family.registry
+        if not registry.enabled:
+            return
+        self.metric.inc(amount)
+        registry.notify(self.family, self.values, amount)
+
+    def observe(self, value):
+        registry = self.family.registry
+        if not registry.enabled:
+            return
+        self.metric.observe(value)
+        registry.notify(self.family, self.values, value)
+
+
+class MetricsRegistry(object):
+    """holds the metric families and the observation listeners"""
+    def __init__(self):
+        self.enabled = True
+        self._families = {}
+        self._listeners = ()
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, label_names):
+        return self._family(name, 'counter', documentation, label_names)
+
+    def histogram(self, name, documentation, label_names, buckets=None):
+        return self._family(name, 'histogram', documentation, label_names, buckets)
+
+    def families(self):
+        return list(self._families.values())
+
+    def add_listener(self, listener):
+        """
+        :param listener: callable(name, labels, value) called on every observation, where labels
+                         is a dict of label name -> value
+        """
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners = tuple(item for item in self._listeners if item is not listener)
+
+    def notify(self, family, values, value):
+        listeners = self._listeners
+        if not listeners:
+            return
+        labels = dict(zip(family.label_names, values))
+        for listener in listeners:
+            listener(family.name, labels, value)
+
+    def forget(self, label_name, value):
+        """drop the series of every family whose label_name is value"""
+        for family in self.families():
+            family.remove_matching(label_name, value)
+
+    def snapshot(self):
+        """
+        :return: dict of metric name -> list of (labels dict, value) where value is a number for
+                 counters and a dict with count, sum, p50 and p99 for histograms
+        """
+        result = {}
+        for family in self.families():
+            samples = []
+            for values, metric in family.children():
+                labels = dict(zip(family.label_names, values))
+                if family.kind == 'counter':
+                    samples.append((labels, metric.value))
+                else:
+                    samples.append((labels, {'count': metric.count, 'sum': metric.sum,
+                                             'p50': metric.percentile(50), 'p99': metric.percentile(99)}))
+            result[family.name] = samples
+        return result
+
+    def _family(self, name, kind, documentation, label_names, buckets=None):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(self, name, kind, documentation, label_names, buckets)
+                self._families[name] = family
+            elif family.kind != kind or family.label_names != tuple(label_names):
+                raise ValueError('Metric {0} is already registered with other type or labels.'.format(name))
+            return family
+
+
+REGISTRY = MetricsRegistry()
+
+TOKEN_REFRESH_SECONDS = REGISTRY.histogram(
+    'hcm_token_refresh_seconds', 'Latency of access token refreshes.', ('app',))
+TOKEN_REFRESHES = REGISTRY.counter(
+    'hcm_token_refresh_total', 'Access token refreshes by result.', ('app', 'result'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'hcm_request_seconds', 'Latency of HCM requests by operation and phase.', ('app', 'operation', 'phase'))
+REQUESTS = REGISTRY.counter(
+    'hcm_requests_total', 'HCM requests by operation and result code.', ('app', 'operation', 'code'))
+SENDER_SECONDS = REGISTRY.histogram(
+    'hcm_sender_seconds', 'Latency of Sender requests by lane and phase.', ('app', 'lane', 'phase'))
+SENDER_EXPIRED = REGISTRY.counter(
+    'hcm_sender_expired_total', 'Sender messages dropped because their ttl passed.', ('app', 'lane'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ['{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+def prometheus_text(registry=REGISTRY):
+    """
+    :param registry: the metrics registry
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for family in registry.families():
+        lines.append('# HELP {0} {1}'.format(family.name, family.documentation))
+        lines.append('# TYPE {0} {1}'.format(family.name, family.kind))
+        for values, metric in family.children():
+            if family.kind == 'counter':
+                lines.append('{0}{1} {2}'.format(family.name, _format_labels(family.label_names, values),
+                                                 metric.value))
+                continue
+            cumulative = 0
+            bounds = [repr(bound) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, metric.bucket_counts):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    family.name, _format_labels(family.label_names, values, ('le', bound)), cumulative))
+            labels = _format_labels(family.label_names, values)
+            lines.append('{0}_count{1} {2}'.format(family.name, labels, metric.count))
+            lines.append('{0}_sum{1} {2!r}'.format(family.name, labels, metric.sum))
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusCollector(object):
+    """
+    Adapter exposing a MetricsRegistry through the optional prometheus_client package:
+
+        prometheus_client.REGISTRY.register(PrometheusCollector())
+    """
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+
+        for family in self.registry.families():
+            if family.kind == 'counter':
+                name = family.name[:-len('_total')] if family.name.endswith('_total') else family.name
+                exported = CounterMetricFamily(name, family.documentation, labels=family.label_names)
+                for values, metric in family.children():
+                    exported.add_metric(list(values), metric.value)
+            else:
+                exported = HistogramMetricFamily(family.name, family.documentation, labels=family.label_names)
+                for values, metric in family.children():
+                    cumulative = 0
+                    buckets = []
+                    for bound, count in zip([repr(bound) for bound in metric.buckets] + ['+Inf'],
+                                            metric.bucket_counts):
+                        cumulative += count
+                        buckets.append((bound, cumulative))
+                    exported.add_metric(list(values), buckets, metric.sum)
+            yield exported
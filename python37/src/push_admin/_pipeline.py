@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streaming send pipeline: source -> validate -> serialize -> send -> sink.
+
+Every stage takes an iterable of PipelineItem and returns a generator of them, so items
+are pulled through one at a time and only the send window is held in memory:
+
+    with messaging.Sender(workers=16) as sender:
+        items = pipeline.source(read_tokens())
+        items = pipeline.validate(items, lambda token: messaging.Message(..., token=[token]))
+        items = pipeline.serialize(items)
+        items = pipeline.send(items, sender, window=256)
+        result = pipeline.sink(items, on_item=write_report_row)
+
+When the source is an async iterable every stage returns an async generator instead and
+sink returns a coroutine. Failed items keep flowing with ``error`` set and skip the
+remaining stages, so the sink sees every source item exactly once.
+"""
+
+import asyncio
+import collections
+import functools
+import json
+import queue
+
+from src.push_admin import _app
+from src.push_admin import _deadline
+
+_ENCODER = _app.App.JSON_ENCODER
+
+
+class PipelineItem(object):
+    """one source item and what the stages made of it"""
+    __slots__ = ('source', 'message', 'body', 'priority', 'ttl', 'response', 'error')
+
+    def __init__(self, source):
+        self.source = source
+        self.message = None
+        self.body = None
+        self.priority = _deadline.PRIORITY_NORMAL
+        self.ttl = None
+        self.response = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.response is not None and self.response.code == _app.App.SUCCESS_CODE
+
+
+class PipelineResult(object):
+    """counts collected by the sink"""
+    def __init__(self):
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.codes = collections.Counter()
+
+    def add(self, item):
+        self.total += 1
+        if item.succeeded:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        if item.error is not None:
+            self.codes[type(item.error).__name__] += 1
+        elif item.response is not None:
+            self.codes[item.response.code] += 1
+
+    def __repr__(self):
+        return 'PipelineResult(total={0}, succeeded={1}, failed={2}, codes={3})'.format(
+            self.total, self.succeeded, self.failed, dict(self.codes))
+
+
+def _is_async(items):
+    return hasattr(items, '__aiter__')
+
+
+def _map(items, function):
+    """apply function to the items without error, sync or async after the input"""
+    if _is_async(items):
+        return _amap(items, function)
+    return _smap(items, function)
+
+
+def _smap(items, function):
+    for item in items:
+        if item.error is None:
+            _apply(function, item)
+        yield item
+
+
+async def _amap(items, function):
+    async for item in items:
+        if item.error is None:
+            _apply(function, item)
+        yield item
+
+
+def _apply(function, item):
+    try:
+        function(item)
+    except Exception as e:
+        item.error = e
+
+
+def source(iterable):
+    """
+    :param iterable: tokens, personalization records or anything the validate stage builds messages from;
+        an iterable or an async iterable
+    :return: generator of PipelineItem
+    """
+    if _is_async(iterable):
+        return _asource(iterable)
+    return (PipelineItem(value) for value in iterable)
+
+
+async def _asource(iterable):
+    async for value in iterable:
+        yield PipelineItem(value)
+
+
+def validate(items, build):
+    """
+    Build the message of every item, messages validate themselves on construction.
+    :param build: callable(source value) returning a ``messaging.Message``
+    """
+    def stage(item):
+        item.message = build(item.source)
+    return _map(items, stage)
+
+
+def serialize(items, validate_only=False):
+    """
+    Serialize every message into a request body and check its payload size. The priority
+    and ttl of the message are kept for the send queue.
+    :param validate_only: dry run mode of the requests
+    """
+    def stage(item):
+        message = _ENCODER.default(item.message)
+        _ENCODER.check_payload_size(message)
+        item.body = json.dumps({'validate_only': validate_only, 'message': message})
+        item.priority = _deadline.message_priority(item.message)
+        item.ttl = _deadline.message_ttl(item.message)
+        item.message = None
+    return _map(items, stage)
+
+
+def send(items, sender, window=None):
+    """
+    Send the bodies through a ``messaging.Sender``, yielding the items in source order.
+    :param sender: the Sender whose threads send the requests
+    :param window: maximum number of items in flight, default the sender's queue size
+    """
+    if window is None:
+        window = sender.queue_size
+    if window < 1:
+        raise ValueError('Pipeline send window must be positive.')
+    if _is_async(items):
+        return _asend(items, sender, window)
+    return _ssend(items, sender, window)
+
+
+def _ssend(items, sender, window):
+    in_flight = collections.deque()
+    for item in items:
+        future = None
+        if item.error is None:
+            try:
+                future = sender.submit_serialized(item.body, priority=item.priority, ttl=item.ttl)
+            except Exception as e:
+                # e.g. the sender was shut down, the item fails like a failed request
+                _fail(item, e)
+        in_flight.append((item, future))
+        if len(in_flight) >= window:
+            yield _complete(*in_flight.popleft())
+    while in_flight:
+        yield _complete(*in_flight.popleft())
+
+
+async def _asend(items, sender, window):
+    loop = asyncio.get_running_loop()
+    in_flight = collections.deque()
+    async for item in items:
+        future = None
+        if item.error is None:
+            submit = functools.partial(sender.submit_serialized, item.body, priority=item.priority, ttl=item.ttl)
+            try:
+                future = asyncio.wrap_future(submit(block=False))
+            except queue.Full:
+                # the sender is shared and full, wait for room off the event loop
+                try:
+                    future = asyncio.wrap_future(await loop.run_in_executor(None, submit))
+                except Exception as e:
+                    _fail(item, e)
+            except Exception as e:
+                _fail(item, e)
+        in_flight.append((item, future))
+        if len(in_flight) >= window:
+            yield await _acomplete(*in_flight.popleft())
+    while in_flight:
+        yield await _acomplete(*in_flight.popleft())
+
+
+def _fail(item, error):
+    item.error = error
+    item.body = None
+
+
+def _complete(item, future):
+    if future is not None:
+        try:
+            item.response = future.result()
+        except Exception as e:
+            item.error = e
+        item.body = None
+    return item
+
+
+async def _acomplete(item, future):
+    if future is not None:
+        try:
+            item.response = await future
+        except Exception as e:
+            item.error = e
+        item.body = None
+    return item
+
+
+def sink(items, on_item=None):
+    """
+    Drain the pipeline.
+    :param on_item: (optional) callable(PipelineItem) called for every item, e.g. to write a report row
+    :return: PipelineResult, or a coroutine of it for an async pipeline
+    """
+    if _is_async(items):
+        return _asink(items, on_item)
+    result = PipelineResult()
+    for item in items:
+        result.add(item)
+        if on_item is not None:
+            on_item(item)
+    return result
+
+
+async def _asink(items, on_item):
+    result = PipelineResult()
+    async for item in items:
+        result.add(item)
+        if on_item is not None:
+            on_item(item)
+    return result
+
+
+def run(iterable, build, sender, validate_only=False, window=None, on_item=None):
+    """
+    Chain all stages: source(iterable) -> validate(build) -> serialize -> send(sender) -> sink(on_item).
+    :return: PipelineResult, or a coroutine of it when iterable is async
+    """
+    items = serialize(validate(source(iterable), build), validate_only)
+    return sink(send(items, sender, window), on_item)
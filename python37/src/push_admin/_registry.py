@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+from src.push_admin import _metrics
+
+
+class AppRegistry(object):
+    """
+    Registry of App instances keyed by app id.
+
+    Reads never take a lock: writers build a new dict under the lock and swap it in, so a
+    reader always sees a complete snapshot. Apps missing from the registry can be built
+    lazily from a credentials provider, and when ``max_apps`` is set the least recently
+    used apps that are not pinned are evicted and closed, along with their metric series.
+    """
+    def __init__(self, max_apps=None):
+        """
+        :param max_apps: (optional) maximum number of registered apps before LRU eviction
+        """
+        self._apps = {}
+        self._last_used = {}
+        # unpinned app ids, least recently used first
+        self._lru = collections.OrderedDict()
+        self._pinned = frozenset()
+        self._provider = None
+        self._factory = None
+        self.max_apps = max_apps
+        self.lock = threading.RLock()
+
+    # ---- dict style access, kept for code that treats push_admin._apps as a dict ----
+
+    def __contains__(self, appid):
+        return appid in self._apps
+
+    def __getitem__(self, appid):
+        return self._apps[appid]
+
+    def __setitem__(self, appid, app):
+        with self.lock:
+            apps = dict(self._apps)
+            apps[appid] = app
+            self._apps = apps
+            self._last_used[appid] = time.monotonic()
+            if appid not in self._pinned:
+                self._lru[appid] = None
+                self._lru.move_to_end(appid)
+
+    def __delitem__(self, appid):
+        if self.remove(appid) is None:
+            raise KeyError(appid)
+
+    def __len__(self):
+        return len(self._apps)
+
+    def __iter__(self):
+        return iter(self._apps)
+
+    def get(self, appid, default=None):
+        app = self._apps.get(appid)
+        if app is None:
+            return default
+        self._last_used[appid] = time.monotonic()
+        try:
+            self._lru.move_to_end(appid)
+        except KeyError:
+            # pinned, or removed meanwhile
+            pass
+        return app
+
+    def keys(self):
+        return self._apps.keys()
+
+    def values(self):
+        return self._apps.values()
+
+    def items(self):
+        return self._apps.items()
+
+    # ---- registry operations ----
+
+    def set_credentials_provider(self, provider, factory):
+        """
+        :param provider: callable(appid) returning a dict of ``factory`` keyword arguments for the
+                         app, or None when the app id is unknown
+        :param factory: callable(appid, **credentials) building an App
+        """
+        with self.lock:
+            self._provider = provider
+            self._factory = factory
+
+    def set_max_apps(self, max_apps):
+        """
+        :param max_apps: maximum number of registered apps, None for no limit; the least
+            recently used apps beyond it are evicted at once
+        """
+        with self.lock:
+            self.max_apps = max_apps
+            self._evict_over_limit()
+
+    def setdefault(self, appid, factory, pin=False):
+        """
+        Register the app built by ``factory()`` unless the app id is already registered.
+        :param pin: never evict the app, e.g. an app initialized explicitly
+        :return: the registered app
+        """
+        app = self.get(appid)
+        if app is not None and not pin:
+            return app
+        with self.lock:
+            if pin:
+                self.pin(appid)
+            app = self._apps.get(appid)
+            if app is None:
+                app = factory()
+                self[appid] = app
+                self._evict_over_limit()
+            return app
+
+    def lookup(self, appid):
+        """
+        Get an app, building it from the credentials provider when it is not registered.
+        The provider runs outside the registry lock, a slow lookup only delays its own app;
+        concurrent first uses of an app may each call it, the first app registered is kept.
+        :return: the app or None
+        """
+        app = self.get(appid)
+        provider, factory = self._provider, self._factory
+        if app is not None or provider is None:
+            return app
+        credentials = provider(appid)
+        if credentials is None:
+            return None
+        with self.lock:
+            app = self._apps.get(appid)
+            if app is not None:
+                return app
+            app = factory(appid, **credentials)
+            self[appid] = app
+            self._evict_over_limit()
+            return app
+
+    def pin(self, appid):
+        """never evict the app registered under this key, e.g. the default app"""
+        with self.lock:
+            self._pinned = self._pinned | {appid}
+            self._lru.pop(appid, None)
+
+    def remove(self, appid):
+        """
+        Unregister an app and close it unless it is still registered under another key.
+        Requests in flight finish on their connections, which are closed after them.
+        :return: the removed app or None
+        """
+        with self.lock:
+            if appid not in self._apps:
+                return None
+            apps = dict(self._apps)
+            app = apps.pop(appid)
+            self._apps = apps
+            self._last_used.pop(appid, None)
+            self._lru.pop(appid, None)
+            self._pinned = self._pinned - {appid}
+            still_used = any(other is app for other in apps.values())
+        if not still_used:
+            app.close()
+            for label in {app.app_id_at, app.appid_push}:
+                _metrics.REGISTRY.forget('app', label)
+        return app
+
+    def evict_idle(self, idle_seconds):
+        """
+        Remove and close the apps that have not been used for ``idle_seconds``.
+        :return: list of evicted app ids
+        """
+        deadline = time.monotonic() - idle_seconds
+        with self.lock:
+            idle = [appid for appid in self._apps
+                    if appid not in self._pinned and self._last_used.get(appid, 0) < deadline]
+            for appid in idle:
+                self.remove(appid)
+        return idle
+
+    def clear(self):
+        with self.lock:
+            for appid in list(self._apps):
+                self.remove(appid)
+
+    def stats(self):
+        """
+        :return: dict of app id -> resource statistics of the app
+        """
+        now = time.monotonic()
+        result = {}
+        for appid, app in self._apps.items():
+            app_stats = app.stats()
+            app_stats['idle_seconds'] = now - self._last_used.get(appid, now)
+            result[appid] = app_stats
+        return result
+
+    def refresh_all(self, max_workers=16, rate=None, force=False, verify_peer=False, timeout=None, app_ids=None):
+        """
+        Refresh the access tokens of the apps concurrently, e.g. after a restart before taking traffic.
+        :param max_workers: maximum number of token requests in flight
+        :param rate: (optional) maximum number of token requests started per second
+        :param force: also refresh the tokens that are still valid
+        :param verify_peer: as for the sends
+        :param timeout: (optional) seconds after which the apps not refreshed yet are reported failed,
+            a refresh still running then goes on in the background
+        :param app_ids: (optional) app ids to refresh, built from the credentials provider if needed;
+            default all registered apps
+        :return: dict with 'apps': app id -> {'ok', 'skipped', 'seconds', 'error'}, the counts of
+            'refreshed', 'skipped' and 'failed' apps, 'elapsed_s' and 'ready', True when none failed
+        """
+        import concurrent.futures
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        results = {}
+        targets = []
+        if app_ids is None:
+            # an app registered under several keys, e.g. the default app, is refreshed once
+            seen = set()
+            for appid, app in list(self._apps.items()):
+                if id(app) not in seen:
+                    seen.add(id(app))
+                    targets.append((appid, app))
+        else:
+            for appid in app_ids:
+                try:
+                    app = self.lookup(appid)
+                except Exception as e:
+                    app = None
+                    results[appid] = {'ok': False, 'skipped': False, 'seconds': 0.0, 'error': repr(e)}
+                if app is not None:
+                    targets.append((appid, app))
+                elif appid not in results:
+                    results[appid] = {'ok': False, 'skipped': False, 'seconds': 0.0, 'error': 'unknown app id'}
+
+        slot_lock = threading.Lock()
+        next_slot = [start]
+
+        def refresh(app):
+            if not force and not app.token_expired:
+                return {'ok': True, 'skipped': True, 'seconds': 0.0, 'error': None}
+            if rate:
+                with slot_lock:
+                    slot = max(next_slot[0], time.monotonic())
+                    next_slot[0] = slot + 1.0 / rate
+                if deadline is not None and slot > deadline:
+                    return {'ok': False, 'skipped': False, 'seconds': 0.0, 'error': 'timeout before the refresh'}
+                time.sleep(max(0.0, slot - time.monotonic()))
+            elif deadline is not None and time.monotonic() > deadline:
+                return {'ok': False, 'skipped': False, 'seconds': 0.0, 'error': 'timeout before the refresh'}
+            begin = time.monotonic()
+            skipped = False
+            try:
+                # skipped when a concurrent sender refreshed the token meanwhile
+                skipped = not app.refresh_token(force, verify_peer)
+                ok, reason = True, None
+            except Exception as e:
+                ok, reason = False, repr(e)
+            return {'ok': ok, 'skipped': skipped, 'seconds': time.monotonic() - begin, 'error': reason}
+
+        if targets:
+            executor = concurrent.futures.ThreadPoolExecutor(max(1, min(max_workers, len(targets))),
+                                                             thread_name_prefix='hcm-refresh')
+            try:
+                futures = [(appid, executor.submit(refresh, app)) for appid, app in targets]
+                for appid, future in futures:
+                    remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    try:
+                        results[appid] = future.result(remaining)
+                    except concurrent.futures.TimeoutError:
+                        future.cancel()
+                        results[appid] = {'ok': False, 'skipped': False, 'seconds': time.monotonic() - start,
+                                          'error': 'timeout'}
+            finally:
+                # a hung refresh must not hold the call, its thread ends with the request timeout
+                executor.shutdown(wait=False)
+
+        failed = sum(1 for result in results.values() if not result['ok'])
+        skipped = sum(1 for result in results.values() if result['skipped'])
+        return {'apps': results, 'refreshed': len(results) - failed - skipped, 'skipped': skipped,
+                'failed': failed, 'elapsed_s': time.monotonic() - start, 'ready': failed == 0}
+
+    def _evict_over_limit(self):
+        if self.max_apps is None:
+            return
+        while len(self._apps) > self.max_apps and self._lru:
+            appid, _ = self._lru.popitem(last=False)
+            self.remove(appid)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replay of a capture through the send path, by default against the local stub:
+
+    python -m benchmark.stub_server --port 8080 &
+    python -m src.push_admin replay capture.jsonl.gz --speed 10 --save replay.json
+
+Requests keep their captured spacing divided by --speed, --speed 0 sends as fast as the
+concurrency allows. The summary compares the replayed latency and result codes with
+the captured ones.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import threading
+import time
+import urllib.parse
+
+from src.push_admin import _app
+from src.push_admin import _capture
+from src.push_admin._loadgen import _percentile
+
+_DEFAULT_URL = 'http://127.0.0.1:8080'
+
+
+def _captured_code(record):
+    if record.get('s') != 200:
+        return 'http_{0}'.format(record.get('s'))
+    try:
+        return str(json.loads(record.get('r') or '').get('code'))
+    except (ValueError, AttributeError):
+        return 'exception'
+
+
+def _summary(latencies, codes, elapsed=None):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'codes': dict(codes),
+    }
+    if elapsed is not None:
+        summary['elapsed'] = elapsed
+        summary['rate'] = len(latencies) / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+def replay(records, push_open_url=_DEFAULT_URL, token_server=None, speed=1.0, concurrency=16,
+           appid='replay', app_secret='replay', verify_peer=False):
+    """
+    :param records: capture records, e.g. from ``_capture.read``
+    :param push_open_url: base URL the captured request paths are sent to
+    :param token_server: (optional) OAuth endpoint, default <push_open_url>/oauth2/v3/token
+    :param speed: time scale of the captured spacing, 0 for no pacing
+    :param concurrency: maximum number of requests in flight
+    :return: dict with the 'captured' and 'replayed' summaries
+    """
+    app = _app.App(appid, app_secret, None, token_server=token_server or push_open_url + '/oauth2/v3/token',
+                   push_open_url=push_open_url)
+    app.reserve_connections(concurrency)
+    in_flight = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    latencies, codes = [], collections.Counter()
+    captured_latencies, captured_codes = [], collections.Counter()
+
+    def send(record, url):
+        begin = time.perf_counter()
+        try:
+            app._update_token(verify_peer)
+            response = app._send_to_server(app._create_header(), record['b'], url, verify_peer,
+                                           operation=record.get('op') or _app.App.OPERATION_SEND)
+            code = str(response.get('code'))
+        except Exception:
+            code = 'exception'
+        finally:
+            in_flight.release()
+        with lock:
+            latencies.append(time.perf_counter() - begin)
+            codes[code] += 1
+
+    executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+    start = time.monotonic()
+    first = None
+    for record in records:
+        captured_latencies.append(record.get('l') or 0.0)
+        captured_codes[_captured_code(record)] += 1
+        if first is None:
+            first = record['t']
+        if speed:
+            delay = start + (record['t'] - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        url = push_open_url + urllib.parse.urlsplit(record['url']).path
+        in_flight.acquire()
+        executor.submit(send, record, url)
+    executor.shutdown(wait=True)
+    elapsed = time.monotonic() - start
+    return {'captured': _summary(captured_latencies, captured_codes),
+            'replayed': _summary(latencies, codes, elapsed)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.push_admin replay',
+                                     description='Replay a captured HCM traffic file through the send path.')
+    parser.add_argument('capture', help='capture file written by messaging.start_capture')
+    parser.add_argument('--push-open-url', default=_DEFAULT_URL, help='push endpoint, default the local stub')
+    parser.add_argument('--token-server', help='OAuth endpoint, default <push-open-url>/oauth2/v3/token')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 0 for as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=16, help='maximum requests in flight')
+    parser.add_argument('--app-id', default='replay')
+    parser.add_argument('--app-secret', default='replay')
+    parser.add_argument('--save', help='write the summary to this JSON file')
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error('--speed must not be negative')
+
+    result = replay(_capture.read(args.capture), push_open_url=args.push_open_url.rstrip('/'),
+                    token_server=args.token_server, speed=args.speed, concurrency=args.concurrency,
+                    appid=args.app_id, app_secret=args.app_secret)
+    captured, replayed = result['captured'], result['replayed']
+    print('{0:<10} {1:>10} {2:>10} {3:>10}  {4}'.format('', 'requests', 'p50 ms', 'p99 ms', 'codes'))
+    for name, summary in (('captured', captured), ('replayed', replayed)):
+        print('{0:<10} {1:>10} {2:>10.2f} {3:>10.2f}  {4}'.format(
+            name, summary['requests'], summary['p50_ms'], summary['p99_ms'], summary['codes']))
+    print('replayed in {0:.1f}s, {1:,.1f} requests/s'.format(replayed['elapsed'], replayed['rate']))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
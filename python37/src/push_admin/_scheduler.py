@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Scheduled sends kept in a hierarchical timing wheel.
+
+The wheel has LEVELS levels of SLOTS slots. An entry due at tick t is kept on the lowest
+level k where t and the current tick agree on all bits above level k, in slot
+(t >> k * SLOT_BITS) % SLOTS. When the current tick reaches the start of that slot the
+entries are moved down a level; on level 0 they are due. Scheduling, cancelling and
+firing an entry are O(1), each entry is moved down at most LEVELS - 1 times.
+"""
+
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+from src.push_admin import _app
+from src.push_admin import _deadline
+
+SLOT_BITS = 8
+SLOTS = 1 << SLOT_BITS
+LEVELS = 4
+
+_ENCODER = _app.App.JSON_ENCODER
+
+
+class _Entry(object):
+    __slots__ = ('id', 'tick', 'fire_at', 'body', 'priority', 'ttl', 'slot')
+
+    def __init__(self, entry_id, tick, fire_at, body, priority, ttl):
+        self.id = entry_id
+        self.tick = tick
+        self.fire_at = fire_at
+        # utf-8 bytes take half the memory of a str with non ASCII text
+        self.body = body
+        self.priority = priority
+        self.ttl = ttl
+        self.slot = None
+
+
+class _Journal(object):
+    """append-only log of scheduled and finished entries, compacted when reopened"""
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+
+    def load(self):
+        """:return: dict of id -> (fire_at, body, priority, ttl) of the entries still pending"""
+        pending = dict()
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line of a crashed process
+                    continue
+                if record.get('op') == 'add':
+                    pending[record['id']] = (record['at'], record['body'], record['priority'], record['ttl'])
+                else:
+                    pending.pop(record.get('id'), None)
+        return pending
+
+    def open(self, pending):
+        """rewrite the journal with the pending entries only and keep it open for appending"""
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            for entry_id, (fire_at, body, priority, ttl) in pending.items():
+                f.write(self._add_line(entry_id, fire_at, body, priority, ttl))
+        os.replace(temp, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _add_line(entry_id, fire_at, body, priority, ttl):
+        return json.dumps({'op': 'add', 'id': entry_id, 'at': fire_at, 'body': body, 'priority': priority,
+                           'ttl': ttl}) + '\n'
+
+    def add(self, entry):
+        self._write(self._add_line(entry.id, entry.fire_at, entry.body.decode('utf-8'), entry.priority, entry.ttl))
+
+    def remove(self, entry_ids):
+        self._write(''.join(json.dumps({'op': 'del', 'id': entry_id}) + '\n' for entry_id in entry_ids))
+
+    def _write(self, text):
+        self._file.write(text)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Scheduler(object):
+    """
+    Send pre-serialized requests at a future time through a Sender:
+
+        with messaging.Sender() as sender, messaging.Scheduler(sender, path='scheduled.log') as scheduler:
+            entry_id = scheduler.schedule(message, at=quiet_hours_end)
+            scheduler.cancel(entry_id)
+
+    Messages are serialized when they are scheduled, so nothing is rebuilt at fire time.
+    Due entries are released into the sender in batches of batch_size. With a path the
+    pending entries are journaled and scheduled again when a Scheduler opens the same path;
+    entries whose time passed while no Scheduler ran fire at once. An entry leaves the
+    journal once the sender queued it, so the entries a failing sender did not take fire
+    again when the journal is reopened.
+    """
+    def __init__(self, sender, tick=1.0, batch_size=500, path=None, fsync=False, on_fire=None):
+        """
+        :param sender: the ``messaging.Sender`` sending the due requests
+        :param tick: resolution of the wheel in seconds
+        :param batch_size: maximum number of requests handed to the sender at once
+        :param path: (optional) journal file keeping the pending entries across restarts
+        :param fsync: fsync the journal after every write
+        :param on_fire: (optional) callable(entry id, future of the SendResponse) called for fired entries
+        """
+        if tick <= 0:
+            raise ValueError('Scheduler tick must be positive.')
+        if batch_size < 1:
+            raise ValueError('Scheduler batch_size must be positive.')
+        self.sender = sender
+        self.tick = tick
+        self.batch_size = batch_size
+        self.on_fire = on_fire
+        self._wheel = [[dict() for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._entries = dict()
+        # id -> entry of the due entries, in due order
+        self._due = dict()
+        self._current = int(time.time() / tick)
+        self._lock = threading.Condition()
+        self._closed = False
+        self._fired = 0
+        self._cancelled = 0
+
+        self._journal = None
+        first_id = 1
+        if path is not None:
+            self._journal = _Journal(path, fsync)
+            pending = self._journal.load()
+            for entry_id, (fire_at, body, priority, ttl) in pending.items():
+                self._place(_Entry(entry_id, self._tick_of(fire_at), fire_at, body.encode('utf-8'), priority, ttl))
+            first_id = max(pending, default=0) + 1
+            self._journal.open(pending)
+        self._ids = itertools.count(first_id)
+        self._thread = threading.Thread(target=self._run, name='hcm-scheduler', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, message, at=None, delay=None, validate_only=False, priority=None, ttl=None):
+        """
+        :param message: An instance of ``messaging.Message``, or the JSON text of a request
+        :param at: fire time in seconds since the epoch, as ``time.time()``
+        :param delay: fire time in seconds from now, instead of at
+        :param validate_only: dry run mode, for a message
+        :param priority: (optional) sender lane, default from the message's urgency and importance
+        :param ttl: (optional) seconds the request stays worth sending after its fire time,
+            default the message's ttl
+        :return: the entry id for cancel
+        """
+        if (at is None) == (delay is None):
+            raise ValueError('Scheduler.schedule needs either at or delay.')
+        fire_at = time.time() + delay if at is None else at
+        if isinstance(message, str):
+            body = message
+        else:
+            message_dict = _ENCODER.default(message)
+            _ENCODER.check_payload_size(message_dict)
+            body = json.dumps({'validate_only': validate_only, 'message': message_dict})
+            if priority is None:
+                priority = _deadline.message_priority(message)
+            if ttl is None:
+                ttl = _deadline.message_ttl(message)
+        if priority is None:
+            priority = _deadline.PRIORITY_NORMAL
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot schedule on a Scheduler after close.')
+            if not self._entries:
+                # the firing thread stopped advancing the idle wheel
+                self._advance(int(time.time() / self.tick))
+            entry = _Entry(next(self._ids), self._tick_of(fire_at), fire_at, body.encode('utf-8'), priority, ttl)
+            self._place(entry)
+            if self._journal is not None:
+                self._journal.add(entry)
+            if entry.slot is None or len(self._entries) == 1:
+                # due at once, or the firing thread sleeps until there is an entry
+                self._lock.notify()
+        return entry.id
+
+    def cancel(self, entry_id):
+        """:return: True if the entry was pending and is cancelled"""
+        with self._lock:
+            entry = self._entries.pop(entry_id, None)
+            if entry is None:
+                return False
+            if entry.slot is None:
+                del self._due[entry_id]
+            else:
+                del entry.slot[entry_id]
+            entry.slot = None
+            self._cancelled += 1
+            if self._journal is not None:
+                self._journal.remove((entry_id,))
+            return True
+
+    def _tick_of(self, fire_at):
+        # round up, an entry never fires before its time
+        return int(math.ceil(fire_at / self.tick))
+
+    def _place(self, entry):
+        self._entries[entry.id] = entry
+        tick = entry.tick
+        if tick <= self._current:
+            entry.slot = None
+            self._due[entry.id] = entry
+            return
+        level = 0
+        while level < LEVELS - 1 and (tick >> (level + 1) * SLOT_BITS) != (self._current >> (level + 1) * SLOT_BITS):
+            level += 1
+        slot = self._wheel[level][(tick >> level * SLOT_BITS) & (SLOTS - 1)]
+        slot[entry.id] = entry
+        entry.slot = slot
+
+    def _advance(self, target):
+        """move the wheel to target tick, collecting the due entries"""
+        if not self._entries:
+            # nothing to cascade, jump over the idle ticks
+            self._current = max(self._current, target)
+            return
+        while self._current < target:
+            self._current += 1
+            current = self._current
+            # move the entries of the higher levels whose slot starts now one level down
+            level = 1
+            while level < LEVELS and current & ((1 << level * SLOT_BITS) - 1) == 0:
+                self._cascade(level, (current >> level * SLOT_BITS) & (SLOTS - 1))
+                level += 1
+            slot = self._wheel[0][current & (SLOTS - 1)]
+            if slot:
+                self._wheel[0][current & (SLOTS - 1)] = dict()
+                for entry in slot.values():
+                    entry.slot = None
+                    self._due[entry.id] = entry
+
+    def _cascade(self, level, index):
+        slot = self._wheel[level][index]
+        if not slot:
+            return
+        self._wheel[level][index] = dict()
+        for entry in slot.values():
+            self._place(entry)
+
+    def _take_due(self):
+        due = list(self._due.values())
+        self._due = dict()
+        for entry in due:
+            del self._entries[entry.id]
+        self._fired += len(due)
+        return due
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    self._advance(int(time.time() / self.tick))
+                    if self._due or self._closed:
+                        break
+                    if not self._entries:
+                        # schedule notifies when the first entry comes in
+                        self._lock.wait()
+                        continue
+                    next_tick = (self._current + 1) * self.tick
+                    self._lock.wait(max(0.0, next_tick - time.time()))
+                due = self._take_due()
+                closed = self._closed
+            # hand out the batches outside the lock, the sender may block on backpressure
+            for i in range(0, len(due), self.batch_size):
+                try:
+                    self._release(due[i:i + self.batch_size])
+                except Exception:
+                    # the entries not queued stay in the journal, the thread keeps firing
+                    import logging
+                    logging.getLogger(__name__).exception('Scheduler failed to release %d entries.',
+                                                          len(due[i:i + self.batch_size]))
+            if closed:
+                return
+
+    def _release(self, entries):
+        futures = self.sender.submit_serialized_batch(
+            (entry.body.decode('utf-8'), entry.priority, entry.ttl) for entry in entries)
+        if self._journal is not None:
+            # a future failed already was not queued, e.g. the sender was shut down
+            queued = [entry.id for entry, future in zip(entries, futures)
+                      if not (future.done() and not future.cancelled() and future.exception() is not None)]
+            if queued:
+                with self._lock:
+                    self._journal.remove(queued)
+        if self.on_fire is not None:
+            for entry, future in zip(entries, futures):
+                self.on_fire(entry.id, future)
+
+    def stats(self):
+        """
+        :return: dict with pending, fired and cancelled entries
+        """
+        return {'pending': len(self._entries), 'fired': self._fired, 'cancelled': self._cancelled}
+
+    def close(self):
+        """stop firing; pending entries stay in the journal, if any"""
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._thread.join()
+        if self._journal is not None:
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Concurrent sending from synchronous code: a pool of sender threads fed by a bounded queue.
+"""
+
+import concurrent.futures
+import queue
+import threading
+import time
+
+from src import push_admin
+from src.push_admin import messaging
+from src.push_admin import _deadline
+from src.push_admin import _metrics
+
+
+class Sender(object):
+    """
+    Send messages from a pool of threads, each submit returns a future of the SendResponse.
+
+        with messaging.Sender(workers=16, queue_size=1000) as sender:
+            futures = [sender.submit(message) for message in messages]
+            responses = [future.result() for future in futures]
+
+    submit blocks while queue_size requests are waiting, so a fast producer is slowed down
+    to the pace of the server instead of queueing without bound. All threads share the
+    pooled connections of the app.
+
+    Messages wait in one lane per priority: high (HIGH urgency or importance), normal and
+    low. Each lane has its own queue_size, so a campaign filling the normal lane does not
+    block the submit of a transactional push. Sender threads pick lanes by weighted fair
+    round robin, and reserved_high threads only ever send from the high lane, so a high
+    message finds a free thread even while every other one waits on a campaign request.
+    Within a lane messages go by the deadline their ttl gives them. A message whose ttl has
+    passed while waiting is dropped before it is serialized and its future fails with
+    ApiCallError. Queue wait and total latency are recorded per lane in hcm_sender_seconds.
+    """
+    def __init__(self, workers=8, queue_size=1000, app_id=None, validate_only=False, verify_peer=False,
+                 drop_expired=True, lane_weights=None, reserved_high=None):
+        """
+        :param workers: number of sender threads
+        :param queue_size: maximum number of submitted requests waiting in each lane
+        :param app_id: application ID
+        :param validate_only: default of submit's validate_only
+        :param verify_peer: HTTPS server identity verification
+        :param drop_expired: drop the messages whose ttl passed before a sender thread took them
+        :param lane_weights: (optional) dict of PRIORITY_* -> share of the shared threads,
+            default high 8, normal 2, low 1
+        :param reserved_high: (optional) threads sending only high lane messages, part of workers,
+            default 1 when there is more than one worker and lane_weights has a high lane
+        """
+        weights = lane_weights or _deadline.DEFAULT_LANE_WEIGHTS
+        if reserved_high is None:
+            reserved_high = 1 if workers > 1 and _deadline.PRIORITY_HIGH in weights else 0
+        if workers < 1:
+            raise ValueError('Sender needs at least one worker.')
+        if queue_size < 1:
+            raise ValueError('Sender queue_size must be positive.')
+        if not 0 <= reserved_high < workers:
+            raise ValueError('Sender reserved_high must leave at least one shared worker.')
+        if reserved_high and _deadline.PRIORITY_HIGH not in weights:
+            raise ValueError('Sender reserved_high needs a PRIORITY_HIGH lane in lane_weights.')
+        self.app_id = app_id
+        self.validate_only = validate_only
+        self.verify_peer = verify_peer
+        self.queue_size = queue_size
+        self.drop_expired = drop_expired
+        app = push_admin.get_app(app_id)
+        app.reserve_connections(workers)
+        self._app_label = app.app_id_at
+
+        self._queue = _deadline.LaneQueue(weights)
+        self._slots = dict((lane, threading.BoundedSemaphore(queue_size)) for lane in weights)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._expired = 0
+        self._threads = []
+        for i in range(workers):
+            lanes = (_deadline.PRIORITY_HIGH,) if i < reserved_high else None
+            self._threads.append(threading.Thread(target=self._run, args=(lanes,), name='hcm-sender-{0}'.format(i),
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self):
+        """number of submitted requests not yet taken by a sender thread"""
+        return len(self._queue)
+
+    def lane_pending(self):
+        """:return: dict of lane name -> number of requests waiting in the lane"""
+        return dict((_deadline.LANE_NAMES.get(lane, str(lane)), self._queue.lane_length(lane))
+                    for lane in self._queue.weights)
+
+    @property
+    def expired(self):
+        """number of messages dropped because their ttl passed in the queue"""
+        return self._expired
+
+    def submit(self, message, validate_only=None, block=True, timeout=None):
+        """
+        :param message: An instance of ``messaging.Message``
+        :param validate_only: (optional) dry run mode, default the Sender's validate_only
+        :param block: wait for room in the queue, otherwise raise queue.Full at once
+        :param timeout: (optional) seconds to wait for room in the queue before raising queue.Full
+        :return: concurrent.futures.Future of the SendResponse, failed with ApiCallError on errors
+        """
+        if validate_only is None:
+            validate_only = self.validate_only
+        deadline = time.monotonic() + _deadline.message_ttl(message)
+        return self._submit(self._send, (message, validate_only), block, timeout,
+                            _deadline.message_priority(message), deadline)
+
+    def submit_serialized(self, body, block=True, timeout=None, priority=_deadline.PRIORITY_NORMAL, ttl=None):
+        """
+        :param body: JSON text of the request, e.g. rendered by ``messaging.MessageTemplate``,
+            sent as is without a payload size check
+        :param priority: (optional) queue priority, one of PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+        :param ttl: (optional) seconds the body stays worth sending, default one day
+        :return: concurrent.futures.Future of the SendResponse
+        """
+        deadline = time.monotonic() + (_deadline.DEFAULT_TTL if ttl is None else ttl)
+        return self._submit(self._send_serialized, (body,), block, timeout, priority, deadline)
+
+    def submit_serialized_batch(self, requests):
+        """
+        Queue many serialized requests with few lock acquisitions, waiting for room as needed.
+        As with submit_serialized, the payload size of the bodies is not checked. When the
+        Sender is shut down midway, the requests queued before go on and the futures of the
+        others fail with the RuntimeError.
+        :param requests: iterable of (body, priority, ttl), ttl None for the default of one day
+        :return: list of concurrent.futures.Future of the SendResponses, in the order of requests
+        Raise: ValueError for a priority without lane, before anything is queued
+        """
+        requests = list(requests)
+        for _, priority, _ in requests:
+            self._lane_slots(priority)
+        futures = []
+        ready = []
+        try:
+            for body, priority, ttl in requests:
+                slots = self._slots[priority]
+                if not slots.acquire(False):
+                    # queue what is ready so the sender threads can make room
+                    self._put_many(ready)
+                    ready = []
+                    slots.acquire()
+                future = concurrent.futures.Future()
+                deadline = time.monotonic() + (_deadline.DEFAULT_TTL if ttl is None else ttl)
+                ready.append(((future, self._send_serialized, (body,), deadline, time.perf_counter()),
+                              priority, deadline))
+                futures.append(future)
+            self._put_many(ready)
+        except Exception as e:
+            for (future, _, _, _, _), lane, _ in ready:
+                self._slots[lane].release()
+                future.set_exception(e)
+            while len(futures) < len(requests):
+                future = concurrent.futures.Future()
+                future.set_exception(e)
+                futures.append(future)
+        return futures
+
+    def _put_many(self, entries):
+        """queue entries whose lane slots are held, the caller releases them on error"""
+        if not entries:
+            return
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot submit to a Sender after shutdown.')
+            self._queue.put_many(entries)
+
+    def _lane_slots(self, priority):
+        if priority not in self._slots:
+            raise ValueError('Sender has no lane for priority {0}.'.format(priority))
+        return self._slots[priority]
+
+    def _submit(self, function, args, block, timeout, priority, deadline):
+        slots = self._lane_slots(priority)
+        # like queue.Queue.put, the timeout only applies to a blocking put
+        if not slots.acquire(block, timeout if block else None):
+            raise queue.Full('Sender queue is full.')
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                slots.release()
+                raise RuntimeError('Cannot submit to a Sender after shutdown.')
+            self._queue.put((future, function, args, deadline, time.perf_counter()), priority, deadline)
+        return future
+
+    def _send(self, message, validate_only):
+        return messaging.send_message(message, validate_only, app_id=self.app_id, verify_peer=self.verify_peer)
+
+    def _send_serialized(self, body):
+        return messaging.send_serialized(body, app_id=self.app_id, verify_peer=self.verify_peer)
+
+    def _run(self, lanes):
+        while True:
+            entry = self._queue.get(lanes)
+            if entry is None:
+                return
+            lane, (future, function, args, deadline, submitted) = entry
+            self._slots[lane].release()
+            if not future.set_running_or_notify_cancel():
+                continue
+            lane_name = _deadline.LANE_NAMES.get(lane, str(lane))
+            _metrics.SENDER_SECONDS.labels(self._app_label, lane_name, 'queue').observe(
+                time.perf_counter() - submitted)
+            if self.drop_expired and deadline <= time.monotonic():
+                with self._lock:
+                    self._expired += 1
+                _metrics.SENDER_EXPIRED.labels(self._app_label, lane_name).inc()
+                future.set_exception(messaging.ApiCallError('Message ttl expired before it was sent.'))
+                continue
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                _metrics.SENDER_SECONDS.labels(self._app_label, lane_name, 'total').observe(
+                    time.perf_counter() - submitted)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stop accepting requests. Queued requests are still sent unless cancel_pending is set.
+        :param wait: block until the sender threads have finished
+        :param cancel_pending: cancel the futures of the requests not yet taken by a sender thread
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                if cancel_pending:
+                    self._cancel_pending()
+                self._queue.close()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _cancel_pending(self):
+        for lane, item in self._queue.drain():
+            item[0].cancel()
+            self._slots[lane].release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
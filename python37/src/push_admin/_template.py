@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import re
+from json.encoder import encode_basestring_ascii
+
+from src.push_admin import _app
+from src.push_admin import _messages
+
+_ENCODER = _app.App.JSON_ENCODER
+
+# placeholder kinds: in a plain string field, in a string of the JSON text of a data field,
+# which is escaped twice, and in the token, topic or condition, outside of the payload size
+_PLAIN = ''
+_NESTED = 'nested'
+_TARGET = 'target'
+
+
+class MessageTemplate(object):
+    """
+    A message with ``${name}`` placeholders in its string fields, rendered straight into
+    serialized request bodies.
+
+    The template message is built, validated and serialized once. Rendering only substitutes
+    the JSON-escaped variable values into the serialized text, so no per-user Message,
+    Notification or AndroidConfig objects are created. Values in the JSON text of a data
+    field are escaped for that text as well, and the payload size of each rendered body
+    is checked.
+
+    For example:
+        template = MessageTemplate(messaging.Message(
+            notification=messaging.Notification(title='Hi ${name}', body='${body}'),
+            android=messaging.AndroidConfig(),
+            token=['${token}']))
+        for body in template.render_batch({'name': names, 'body': bodies, 'token': tokens}):
+            messaging.send_serialized(body)
+    """
+    PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+    _SLOT = re.compile(r'\$\{(\w+)(?::(nested|target))?\}')
+
+    def __init__(self, message, validate_only=False, max_payload_size=None):
+        """
+        :param message: An instance of ``messaging.Message`` with placeholders in its string fields
+        :param validate_only: validate message format or not
+        :param max_payload_size: (optional) limit of a rendered payload in bytes, default
+            ``MessageSerializer.MAX_PAYLOAD_SIZE``
+        """
+        if not isinstance(message, _messages.Message):
+            raise ValueError('MessageTemplate.message must be an instance of Message class.')
+        message_dict = _ENCODER.default(message)
+        self.max_payload_size = _ENCODER.MAX_PAYLOAD_SIZE if max_payload_size is None else max_payload_size
+        # size of the payload with the placeholders, each rendered value replaces its placeholder
+        self._base_payload_size = _ENCODER.payload_size(message_dict)
+        self._mark_slots(message_dict)
+        text = json.dumps({'validate_only': validate_only, 'message': message_dict})
+
+        self.variables = []
+        # (variable index, kind) of each placeholder
+        self._slots = []
+        parts = []
+        position = 0
+        for match in self._SLOT.finditer(text):
+            name = match.group(1)
+            if name not in self.variables:
+                self.variables.append(name)
+            parts.append(self._escape_braces(text[position:match.start()]))
+            parts.append('{' + str(len(self._slots)) + '}')
+            self._slots.append((self.variables.index(name), match.group(2) or _PLAIN))
+            position = match.end()
+        parts.append(self._escape_braces(text[position:]))
+        self._format = ''.join(parts)
+
+    @classmethod
+    def _mark(cls, text, kind):
+        return cls.PLACEHOLDER.sub(lambda match: '${' + match.group(1) + ':' + kind + '}', text)
+
+    @classmethod
+    def _mark_slots(cls, message_dict):
+        """tag the placeholders of the data fields holding JSON text and of the target fields"""
+        for container in (message_dict, message_dict.get('android')):
+            data = container.get('data') if isinstance(container, dict) else None
+            if isinstance(data, str) and cls.PLACEHOLDER.search(data):
+                try:
+                    json.loads(data)
+                except ValueError:
+                    continue
+                container['data'] = cls._mark(data, _NESTED)
+        if message_dict.get('token'):
+            message_dict['token'] = [cls._mark(token, _TARGET) for token in message_dict['token']]
+        for field in ('topic', 'condition'):
+            if isinstance(message_dict.get(field), str):
+                message_dict[field] = cls._mark(message_dict[field], _TARGET)
+
+    @staticmethod
+    def _escape_braces(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    def render(self, **variables):
+        """
+        :param variables: value of each placeholder
+        :return: the serialized request body
+        Raise: ValueError if a variable is missing or the payload is too large
+        """
+        try:
+            values = [variables[name] for name in self.variables]
+        except KeyError as e:
+            raise ValueError('MessageTemplate variable {0} is missing.'.format(e))
+        return self._render_row(values)
+
+    def render_batch(self, batch):
+        """
+        Render one request body per row of a columnar batch.
+        :param batch: dict of variable name -> list of values, a pandas DataFrame or a pyarrow Table
+        :return: generator of serialized request bodies
+        Raise: ValueError if a variable is missing, the columns differ in length or a payload is too large
+        """
+        columns = [self._column(batch, name) for name in self.variables]
+        render_row = self._render_row
+        if not columns:
+            for _ in range(self._row_count(batch)):
+                yield render_row(())
+            return
+        if len(set(len(column) for column in columns)) > 1:
+            raise ValueError('MessageTemplate batch columns must have the same length, got {0}.'.format(
+                dict((name, len(column)) for name, column in zip(self.variables, columns))))
+        for values in zip(*columns):
+            yield render_row(values)
+
+    def _render_row(self, values):
+        escaped = [encode_basestring_ascii(value if isinstance(value, str) else str(value))[1:-1]
+                   for value in values]
+        arguments = []
+        size = self._base_payload_size
+        for index, kind in self._slots:
+            value = escaped[index]
+            if kind == _NESTED:
+                # once for the JSON text of the data field, once for the request body
+                value = encode_basestring_ascii(value)[1:-1]
+            if kind != _TARGET:
+                size += len(value) - len(self.variables[index]) - 3
+            arguments.append(value)
+        if size > self.max_payload_size:
+            raise ValueError('Message payload is {0} bytes, it must not exceed {1} bytes.'.format(
+                size, self.max_payload_size))
+        return self._format.format(*arguments)
+
+    @staticmethod
+    def _row_count(batch):
+        if isinstance(batch, dict):
+            return len(next(iter(batch.values()))) if batch else 0
+        # pandas.DataFrame and pyarrow.Table
+        return len(batch)
+
+    @staticmethod
+    def _column(batch, name):
+        try:
+            if isinstance(batch, dict):
+                return batch[name]
+            if hasattr(batch, 'column_names') and hasattr(batch, 'column'):
+                # pyarrow.Table
+                return batch.column(name).to_pylist()
+            # pandas.DataFrame
+            return batch[name].tolist()
+        except KeyError:
+            raise ValueError('MessageTemplate variable {0} is missing in the batch.'.format(name))
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+
+class TopicIndex(object):
+    """
+    Local topic membership index: token -> topics and topic -> token count.
+
+    Entries are filled from our own subscribe/unsubscribe calls and from topic:list
+    query results. Each entry expires after ``ttl`` seconds and the least recently
+    used entries are evicted once more than ``max_tokens`` tokens are held.
+
+    An entry is *complete* when it holds every topic of the token, i.e. it came from
+    a topic:list query, or the index is ``authoritative`` (all subscriptions of the
+    application are made through this SDK). Only complete entries can answer
+    ``list_topics`` locally.
+    """
+    def __init__(self, ttl=3600, max_tokens=1000000, authoritative=False):
+        """
+        :param ttl: lifetime of an entry in seconds
+        :param max_tokens: maximum number of tokens held before LRU eviction
+        :param authoritative: treat entries built from subscribe calls as complete
+        """
+        if ttl <= 0:
+            raise ValueError('TopicIndex.ttl must be positive.')
+        if max_tokens <= 0:
+            raise ValueError('TopicIndex.max_tokens must be positive.')
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.authoritative = authoritative
+        # token -> [expire_at, complete, {topic_name: add_date}], in LRU order
+        self._entries = collections.OrderedDict()
+        # token -> expire_at, in expiry order since the ttl is the same for every entry
+        self._expiry = collections.OrderedDict()
+        self._topic_counts = collections.Counter()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, token):
+        with self._lock:
+            return self._get_fresh(token) is not None
+
+    def get_topics(self, token):
+        """
+        :param token: the token to be queried
+        :return: list of {'name': ..., 'addDate': ...} dicts, or None if the token has no
+                 fresh and complete entry
+        """
+        with self._lock:
+            entry = self._get_fresh(token)
+            if entry is None or not entry[1]:
+                return None
+            return [{'name': name, 'addDate': add_date} for name, add_date in entry[2].items()]
+
+    def topic_names(self, token):
+        """
+        :param token: the token to be queried
+        :return: frozenset of the known topic names of a fresh entry, or None
+        """
+        with self._lock:
+            entry = self._get_fresh(token)
+            if entry is None:
+                return None
+            return frozenset(entry[2])
+
+    def topic_count(self, topic):
+        """number of indexed tokens subscribed to the topic"""
+        with self._lock:
+            return self._topic_counts.get(topic, 0)
+
+    def topic_counts(self):
+        """dict of topic -> number of indexed tokens"""
+        with self._lock:
+            return dict(self._topic_counts)
+
+    def tokens(self, topic=None):
+        """
+        :param topic: (optional) only return tokens subscribed to this topic
+        :return: list of tokens with a fresh entry
+        """
+        with self._lock:
+            self.purge_expired()
+            if topic is None:
+                return list(self._entries)
+            return [token for token, entry in self._entries.items() if topic in entry[2]]
+
+    def snapshot(self, topics, tokens=None, complete_only=False):
+        """
+        Collect the subscribers of several topics in a single pass.
+        :param topics: the topic names of interest
+        :param tokens: (optional) restrict the snapshot to these tokens
+        :param complete_only: leave out the entries that may miss topics, e.g. built from subscribe calls
+        :return: (universe, members) where universe is the set of tokens with a fresh entry and
+                 members maps each topic to the set of its subscribers within the universe
+        """
+        members = dict((topic, set()) for topic in topics)
+        with self._lock:
+            self.purge_expired()
+            if tokens is None:
+                candidates = self._entries.items()
+            else:
+                candidates = ((token, self._entries.get(token)) for token in set(tokens))
+            universe = set()
+            for token, entry in candidates:
+                if entry is None or (complete_only and not entry[1]):
+                    continue
+                universe.add(token)
+                for topic in members:
+                    if topic in entry[2]:
+                        members[topic].add(token)
+        return universe, members
+
+    def put_topics(self, token, topics):
+        """
+        Store the complete topic list of a token, as returned by topic:list.
+        :param token: the token
+        :param topics: list of {'name': ..., 'addDate': ...} dicts or topic names
+        """
+        subscriptions = dict()
+        for topic in topics or []:
+            if isinstance(topic, dict):
+                subscriptions[topic.get('name')] = topic.get('addDate')
+            else:
+                subscriptions[topic] = None
+        with self._lock:
+            self._drop(token)
+            self._store(token, True, subscriptions)
+
+    def subscribe(self, topic, token_list):
+        """record that the tokens were subscribed to the topic"""
+        add_date = time.strftime('%Y-%m-%d')
+        with self._lock:
+            for token in token_list:
+                entry = self._get_fresh(token)
+                if entry is None:
+                    self._store(token, self.authoritative, {topic: add_date})
+                    continue
+                # the ttl is only renewed by a topic:list response, see put_topics
+                if topic not in entry[2]:
+                    entry[2][topic] = add_date
+                    self._topic_counts[topic] += 1
+
+    def unsubscribe(self, topic, token_list):
+        """record that the tokens were unsubscribed from the topic"""
+        with self._lock:
+            for token in token_list:
+                entry = self._get_fresh(token)
+                if entry is None:
+                    if self.authoritative:
+                        self._store(token, True, dict())
+                    continue
+                if topic in entry[2]:
+                    del entry[2][topic]
+                    self._decrement(topic)
+
+    def invalidate(self, token_list):
+        """forget the tokens, the next lookup goes to the server"""
+        with self._lock:
+            for token in token_list:
+                self._drop(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+            self._topic_counts.clear()
+
+    def purge_expired(self):
+        """remove all expired entries
+        :return: the number of removed entries
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            # only the expired head of the expiry order is visited
+            while self._expiry:
+                token, expire_at = next(iter(self._expiry.items()))
+                if expire_at > now:
+                    break
+                self._drop(token)
+                removed += 1
+            return removed
+
+    def _get_fresh(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._drop(token)
+            return None
+        self._entries.move_to_end(token)
+        return entry
+
+    def _store(self, token, complete, subscriptions):
+        expire_at = time.time() + self.ttl
+        self._entries[token] = [expire_at, complete, subscriptions]
+        self._expiry[token] = expire_at
+        self._expiry.move_to_end(token)
+        self._topic_counts.update(subscriptions.keys())
+        while len(self._entries) > self.max_tokens:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        self._expiry.pop(token, None)
+        for topic in entry[2]:
+            self._decrement(topic)
+
+    def _decrement(self, topic):
+        count = self._topic_counts[topic] - 1
+        if count > 0:
+            self._topic_counts[topic] = count
+        else:
+            del self._topic_counts[topic]
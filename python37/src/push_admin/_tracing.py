@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight spans along the push path: messaging -> App -> _http.
+
+Nothing is recorded until a hook is added with ``add_hook``; until then ``start_span``
+returns a shared no-op span. The current span is kept in a ``contextvars.ContextVar``,
+so nesting follows the caller's thread or asyncio task. A hook raising is logged and
+never fails the traced operation.
+"""
+
+import contextvars
+import threading
+import time
+
+_current_span = contextvars.ContextVar('hcm_current_span', default=None)
+_hooks = ()
+_hooks_lock = threading.Lock()
+
+
+class Span(object):
+    """
+    A timed operation.
+    Attributes set along the push path: operation, app, url, payload_size, request_id, code,
+    http_status.
+    """
+    __slots__ = ('name', 'attributes', 'parent', 'start_time', 'end_time', 'error', 'native', '_token', '_hooks')
+
+    def __init__(self, name, attributes, parent, hooks):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.error = None
+        # slot for hooks to keep their own span object, e.g. an OpenTelemetry span
+        self.native = None
+        self._token = None
+        self._hooks = hooks
+
+    @property
+    def duration(self):
+        """duration in seconds, None while the span is running"""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        self.error = error
+        for _, on_end in self._hooks:
+            if on_end is not None:
+                _call_hook(on_end, self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_span.reset(self._token)
+        self.end(exc_value)
+        return False
+
+
+class _NoopSpan(object):
+    """returned by start_span when tracing is disabled"""
+    __slots__ = ()
+    name = None
+    attributes = None
+    parent = None
+    duration = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def add_hook(on_start=None, on_end=None):
+    """
+    Enable tracing with a pair of callbacks.
+    :param on_start: callable(span) called when a span starts
+    :param on_end: callable(span) called when a span ends, span.duration and span.error are set
+    :return: a handle for ``remove_hook``
+    """
+    global _hooks
+    hook = (on_start, on_end)
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+    return hook
+
+
+def remove_hook(hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(item for item in _hooks if item is not hook)
+
+
+def is_enabled():
+    return bool(_hooks)
+
+
+def current_span():
+    """the innermost running span of this thread or task, or None"""
+    return _current_span.get()
+
+
+def start_span(name, **attributes):
+    """
+    Start a span, to be used as a context manager:
+
+        with start_span('hcm.request', operation='send') as span:
+            span.set_attribute('code', code)
+
+    :return: a Span, or a no-op span when no hook is added
+    """
+    hooks = _hooks
+    if not hooks:
+        return NOOP_SPAN
+    span = Span(name, attributes, _current_span.get(), hooks)
+    for on_start, _ in hooks:
+        if on_start is not None:
+            _call_hook(on_start, span)
+    return span
+
+
+def _call_hook(hook, span):
+    try:
+        hook(span)
+    except Exception:
+        # logging is imported on the first failure only, it is not needed on the send path
+        import logging
+        logging.getLogger(__name__).exception('Tracing hook %r failed on span %s.', hook, span.name)
+
+
+def enable_opentelemetry(tracer=None):
+    """
+    Mirror the spans into OpenTelemetry, requires the opentelemetry-api package.
+    :param tracer: (optional) an OpenTelemetry tracer, default one from the global tracer provider
+    :return: the hook handle
+    """
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        raise ValueError('OpenTelemetry tracing requires the opentelemetry-api package.')
+    if tracer is None:
+        tracer = trace.get_tracer('push_admin')
+
+    def on_start(span):
+        context = None
+        if span.parent is not None and span.parent.native is not None:
+            context = trace.set_span_in_context(span.parent.native)
+        span.native = tracer.start_span(span.name, context=context)
+
+    def on_end(span):
+        native = span.native
+        if native is None:
+            return
+        for key, value in span.attributes.items():
+            if value is not None:
+                native.set_attribute('hcm.' + key, value)
+        if span.error is not None:
+            native.record_exception(span.error)
+            native.set_status(trace.Status(trace.StatusCode.ERROR, str(span.error)))
+        native.end()
+
+    return add_hook(on_start, on_end)
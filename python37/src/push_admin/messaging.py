@@ -14,7 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from src.push_admin import _messages, _app
+import importlib
+
+from src.push_admin import _messages, _app, _metrics, _tracing
 from src import push_admin
 
 """HUAWEI Cloud Messaging module."""
@@ -49,6 +51,82 @@ APNsHMSOptions = _messages.APNsHMSOptions
 """Common exception definition"""
 ApiCallError = _app.ApiCallError
 
+"""SDK metrics: counters and latency histograms per app and operation"""
+metrics = _metrics.REGISTRY
+prometheus_text = _metrics.prometheus_text
+PrometheusCollector = _metrics.PrometheusCollector
+
+"""Tracing hooks along messaging -> App -> HTTP"""
+add_trace_hook = _tracing.add_hook
+remove_trace_hook = _tracing.remove_hook
+enable_opentelemetry = _tracing.enable_opentelemetry
+
+"""
+Names below are imported on first access, by __getattr__, so that importing messaging
+does not pay for asyncio, multiprocessing and the other modules of the optional features.
+name -> (module, attribute of the module, or None for the module itself)
+"""
+_LAZY = {
+    # Local topic membership index and condition expressions
+    'TopicIndex': ('_topic_index', 'TopicIndex'),
+    'ConditionExpression': ('_condition', 'ConditionExpression'),
+    'compile_condition': ('_condition', 'compile_condition'),
+    # Personalized message templates
+    'MessageTemplate': ('_template', 'MessageTemplate'),
+    # Multi-process dispatch of pre-serialized request bodies
+    'ProcessDispatcher': ('_dispatch_pool', 'ProcessDispatcher'),
+    # Thread pool sender with a bounded queue, ordered by priority and ttl deadline
+    'Sender': ('_sender', 'Sender'),
+    'PRIORITY_HIGH': ('_deadline', 'PRIORITY_HIGH'),
+    'PRIORITY_NORMAL': ('_deadline', 'PRIORITY_NORMAL'),
+    'PRIORITY_LOW': ('_deadline', 'PRIORITY_LOW'),
+    # Streaming send pipeline: source -> validate -> serialize -> send -> sink
+    'pipeline': ('_pipeline', None),
+    'PipelineItem': ('_pipeline', 'PipelineItem'),
+    'PipelineResult': ('_pipeline', 'PipelineResult'),
+    # Coalescing of notifications by collapse_key or tag
+    'CoalescingQueue': ('_coalescing', 'CoalescingQueue'),
+    'coalesce_key': ('_coalescing', 'coalesce_key'),
+    # Micro-batching of identical token messages into multicast requests
+    'MicroBatcher': ('_batcher', 'MicroBatcher'),
+    # Scheduled sends in a timing wheel
+    'Scheduler': ('_scheduler', 'Scheduler'),
+    # Capture of HCM requests for replay with python -m src.push_admin replay
+    'start_capture': ('_capture', 'start'),
+    'stop_capture': ('_capture', 'stop'),
+    'read_capture': ('_capture', 'read'),
+    # Delivery receipts joined to the sends by bi_tag or requestId
+    'ReceiptReceiver': ('_receipts', 'ReceiptReceiver'),
+    'SendIndex': ('_receipts', 'SendIndex'),
+    # Suppression of duplicate sends with rotating Bloom filters
+    'Deduplicator': ('_dedup', 'Deduplicator'),
+    # Columnar results of a batch of requests
+    'BatchResult': ('_batch_result', 'BatchResult'),
+    'send_chunks': ('_batch_result', 'send_chunks'),
+    # Per-locale variants of a message rendered on the server
+    'LocalizedMessage': ('_localization', 'LocalizedMessage'),
+}
+
+
+def __getattr__(name):
+    try:
+        module_name, attribute = _LAZY[name]
+    except KeyError:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+    module = importlib.import_module('src.push_admin.' + module_name)
+    value = module if attribute is None else getattr(module, attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+_SUCCESS_CODE = _app.App.SUCCESS_CODE
+# some of the tokens of the request failed, see the errors of the response
+_PARTIAL_SUCCESS_CODE = '80100000'
+
 
 def send_message(message, validate_only=False, app_id=None, verify_peer=False):
     """
@@ -63,11 +141,34 @@ def send_message(message, validate_only=False, app_id=None, verify_peer=False):
         Raises:
             ApiCallError: If an error occurs while sending the message to the HCM service.
     """
-    try:
-        response = push_admin.get_app(app_id).send(message, validate_only, verify_peer=verify_peer)
-        return SendResponse(response)
-    except Exception as e:
-        raise ApiCallError(repr(e))
+    with _tracing.start_span('hcm.send_message', app=app_id):
+        try:
+            response = push_admin.get_app(app_id).send(message, validate_only, verify_peer=verify_peer)
+            return SendResponse(response)
+        except Exception as e:
+            raise ApiCallError(repr(e))
+
+
+def send_serialized(body, app_id=None, verify_peer=False):
+    """
+        Sends an already serialized request body, e.g. rendered by ``messaging.MessageTemplate``
+        The payload size of the body is not checked here; MessageTemplate and the other
+        builders of serialized bodies in this package check it when rendering.
+        :param body: JSON text of the request
+        :param app_id: app id parameters obtained by developer alliance applying for Push service (optional).
+        :param verify_peer: (optional) Either a boolean, in which case it controls whether we verify
+            the server's TLS certificate, or a string, in which case it must be a path
+            to a CA bundle to use. Defaults to ``True``.
+        :return: SendResponse
+        Raises:
+            ApiCallError: If an error occurs while sending the message to the HCM service.
+    """
+    with _tracing.start_span('hcm.send_message', app=app_id):
+        try:
+            response = push_admin.get_app(app_id).send_serialized(body, verify_peer=verify_peer)
+            return SendResponse(response)
+        except Exception as e:
+            raise ApiCallError(repr(e))
 
 
 def subscribe_topic(topic, token_list, app_id=None):
@@ -77,8 +178,10 @@ def subscribe_topic(topic, token_list, app_id=None):
     :param app_id: application ID
     """
     try:
-        response = push_admin.get_app(app_id).subscribe_topic(topic, token_list)
-        return TopicSubscribeResponse(response)
+        app = push_admin.get_app(app_id)
+        response = TopicSubscribeResponse(app.subscribe_topic(topic, token_list))
+        _update_topic_index(app.topic_index, topic, token_list, response, subscribed=True)
+        return response
     except Exception as e:
         raise ApiCallError(repr(e))
 
@@ -90,29 +193,83 @@ def unsubscribe_topic(topic, token_list, app_id=None):
     :param app_id: application ID
     """
     try:
-        response = push_admin.get_app(app_id).unsubscribe_topic(topic, token_list)
-        return TopicSubscribeResponse(response)
+        app = push_admin.get_app(app_id)
+        response = TopicSubscribeResponse(app.unsubscribe_topic(topic, token_list))
+        _update_topic_index(app.topic_index, topic, token_list, response, subscribed=False)
+        return response
     except Exception as e:
         raise ApiCallError(repr(e))
 
 
-def list_topics(token, app_id=None):
+def list_topics(token, app_id=None, use_cache=True):
     """
     :param token: The token to be queried
     :param app_id: application ID
+    :param use_cache: answer from the app's topic index when it holds a fresh entry for the token
     """
     try:
-        response = push_admin.get_app(app_id).query_subscribe_list(token)
-        return TopicQueryResponse(response)
+        app = push_admin.get_app(app_id)
+        if use_cache:
+            topics = app.topic_index.get_topics(token)
+            if topics is not None:
+                return TopicQueryResponse({'msg': 'Success', 'code': _SUCCESS_CODE, 'requestId': '',
+                                           'topics': topics})
+        response = TopicQueryResponse(app.query_subscribe_list(token))
+        if response.code == _SUCCESS_CODE:
+            app.topic_index.put_topics(token, response.topics)
+        return response
     except Exception as e:
         raise ApiCallError(repr(e))
 
 
+def sync_topic_index(token_list, app_id=None):
+    """
+    Query the topics of every token from the server and load them into the app's topic index.
+    :param token_list: The tokens to be queried
+    :param app_id: application ID
+    :return: dict of token -> failure reason for the tokens that could not be queried
+    """
+    app = push_admin.get_app(app_id)
+    failures = dict()
+    for token in token_list:
+        try:
+            response = TopicQueryResponse(app.query_subscribe_list(token))
+        except Exception as e:
+            failures[token] = repr(e)
+            continue
+        if response.code == _SUCCESS_CODE:
+            app.topic_index.put_topics(token, response.topics)
+        else:
+            failures[token] = response.msg
+    return failures
+
+
+def _update_topic_index(topic_index, topic, token_list, response, subscribed):
+    """apply the result of a topic (un)subscribe request to the topic index"""
+    if str(response.code) not in (_SUCCESS_CODE, _PARTIAL_SUCCESS_CODE):
+        # the request failed as a whole, the subscriptions did not change
+        return
+    update = topic_index.subscribe if subscribed else topic_index.unsubscribe
+    if response.failureCount == 0:
+        update(topic, token_list)
+        return
+    failed = set()
+    for error in response.errors or []:
+        if not isinstance(error, dict) or 'index' not in error:
+            # cannot tell which tokens failed, let the server answer for all of them
+            topic_index.invalidate(token_list)
+            return
+        failed.add(error['index'])
+    update(topic, [token for index, token in enumerate(token_list) if index not in failed])
+
+
 class SendResponse(object):
     """
         The response received from an send request to the HCM API.
         response: received http response body text from HCM.
     """
+    __slots__ = ('_code', '_msg', '_requestId')
+
     def __init__(self, response=None):
         try:
             self._code = response['code']
@@ -136,6 +293,10 @@ class SendResponse(object):
         """A message ID string that uniquely identifies the message."""
         return self._requestId
 
+    def __repr__(self):
+        return 'SendResponse(code={0!r}, reason={1!r}, requestId={2!r})'.format(
+            self._code, self._msg, self._requestId)
+
 
 class BaseTopicResponse(object):
     """
@@ -145,6 +306,8 @@ class BaseTopicResponse(object):
        "requestId": "157466304904000004000701"
      }
     """
+    __slots__ = ('_msg', '_code', '_requestId')
+
     def __init__(self, json_rsp=None):
         if json_rsp is None:
             self._msg = ""
@@ -179,6 +342,8 @@ class TopicSubscribeResponse(BaseTopicResponse):
        "errors": []
      }
     """
+    __slots__ = ('_successCount', '_failureCount', '_errors')
+
     def __init__(self, json_rsp=None):
         super(TopicSubscribeResponse, self).__init__(json_rsp=json_rsp)
         if json_rsp is None:
@@ -215,6 +380,8 @@ class TopicQueryResponse(BaseTopicResponse):
                          } ]
          }
     """
+    __slots__ = ('_topics',)
+
     def __init__(self, json_rsp=None):
         super(TopicQueryResponse, self).__init__(json_rsp)
         self._topics = json_rsp['topics']
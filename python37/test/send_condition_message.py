@@ -15,7 +15,6 @@
 # limitations under the License.
 
 from src import push_admin
-import json
 from src.push_admin import messaging
 
 
@@ -76,7 +75,7 @@ def send_push_android_data_message():
         notification=notification,
         android=android,
         # TODO
-        condition="'your topic' in topics"
+        condition="'your_topic' in topics"
     )
 
     try:
@@ -87,7 +86,7 @@ def send_push_android_data_message():
         # Case 3: use certifi Library
         # import certifi
         # response = messaging.send_message(message, verify_peer=certifi.where())
-        print("response is ", json.dumps(vars(response)))
+        print("response is ", response)
         assert (response.code == '80000000')
     except Exception as e:
         print(repr(e))
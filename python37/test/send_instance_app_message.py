@@ -14,7 +14,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 
 from src import push_admin
 from src.push_admin import messaging
@@ -56,7 +55,7 @@ def send_push_android_data_message():
         # Case 3: use certifi Library
         # import certifi
         # response = messaging.send_message(message, verify_peer=certifi.where())
-        print("response is ", json.dumps(vars(response)))
+        print("response is ", response)
         assert (response.code == '80000000')
     except Exception as e:
         print(repr(e))
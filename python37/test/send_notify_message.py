@@ -15,7 +15,6 @@
 # limitations under the License.
 
 from src import push_admin
-import json
 from src.push_admin import messaging
 
 
@@ -88,7 +87,7 @@ def send_push_android_notify_message():
         # Case 3: use certifi Library
         # import certifi
         # response = messaging.send_message(message, verify_peer=certifi.where())
-        print("response is ", json.dumps(vars(response)))
+        print("response is ", response)
         assert (response.code == '80000000')
     except Exception as e:
         print(repr(e))